@@ -3,6 +3,7 @@
 
 import logging
 import sys
+import threading
 
 from flask import Flask
 import bpo.api
@@ -10,12 +11,15 @@ import bpo.api.job_callback.build_image
 import bpo.api.job_callback.build_package
 import bpo.api.job_callback.get_depends
 import bpo.api.job_callback.sign_index
+import bpo.api.job_callback.upload
 import bpo.api.public.update_job_status
 import bpo.api.push_hook.gitlab
 import bpo.config.args
 import bpo.config.tokens
 import bpo.db
 import bpo.helpers.job
+import bpo.helpers.upload
+import bpo.helpers.worker
 import bpo.images.queue
 import bpo.repo
 import bpo.repo.tools
@@ -41,22 +45,20 @@ def init_components():
     bpo.ui.init()
 
 
-def main(return_app=False, fill_image_queue=True):
-    """ :param return_app: return the flask app, instead of running it. This
-                           is used in the testsuite.
-        :param fill_image_queue: add new images (if the interval has been
-                                 reached). This is disabled in tests, where we
-                                 don't want to test building images. """
-    init_components()
-
-    # Update UI by writing a new log message
-    bpo.ui.log("restart")
-
-    # Maintenance tasks (fix repo inconsistencies, remove old images etc.)
-    bpo.repo.status.fix()
-    bpo.images.queue.remove_not_in_config()
-    bpo.images.remove_old()
-    bpo.ui.images.write_index_all()
+def maintenance(fill_image_queue=True):
+    """ Fix repo inconsistencies, remove old images, start build jobs etc.
+        after the bpo server was (re)started.
+        :param fill_image_queue: see main() """
+    try:
+        bpo.repo.status.fix()
+        bpo.images.queue.remove_not_in_config()
+        bpo.images.remove_old()
+        bpo.helpers.upload.remove_old_staging()
+        bpo.helpers.upload.remove_temp_files(bpo.config.args.images_path)
+        bpo.ui.images.write_index_all()
+    finally:
+        # Don't keep the image tasks blocked forever if fixing failed
+        bpo.helpers.worker.unblock_images()
 
     if bpo.config.args.force_final_repo_sign:
         # Force final repo sign
@@ -75,21 +77,68 @@ def main(return_app=False, fill_image_queue=True):
         for branch in bpo.config.const.branches.keys():
             bpo.jobs.get_depends.run(branch)
 
+    # Run callback tasks, that were queued before the restart
+    bpo.helpers.worker.start()
+
     # Restart is complete
     bpo.ui.log("restart_done")
 
+
+class MaintenanceThread(threading.Thread):
+    """ Run maintenance() while the API is already answering requests. Tasks
+        queued by job callbacks wait until their branch and arch are fixed,
+        image tasks also wait until the images are fixed. """
+
+    def __init__(self, fill_image_queue):
+        threading.Thread.__init__(self, name="MaintenanceThread", daemon=True)
+        self.fill_image_queue = fill_image_queue
+
+    def run(self):
+        try:
+            maintenance(self.fill_image_queue)
+        except Exception:
+            logging.exception("Maintenance after restart failed")
+
+
+def main(return_app=False, fill_image_queue=True):
+    """ :param return_app: return the flask app, instead of running it. This
+                           is used in the testsuite.
+        :param fill_image_queue: add new images (if the interval has been
+                                 reached). This is disabled in tests, where we
+                                 don't want to test building images. """
+    init_components()
+
+    # Update UI by writing a new log message
+    bpo.ui.log("restart")
+
+    # Maintenance tasks (fix repo inconsistencies, remove old images etc.)
+    if bpo.config.args.background_maintenance:
+        for branch, branch_data in bpo.config.const.branches.items():
+            for arch in branch_data["arches"]:
+                bpo.helpers.worker.block(branch, arch)
+        bpo.helpers.worker.block_images()
+        bpo.helpers.worker.start()
+        MaintenanceThread(fill_image_queue).start()
+    else:
+        maintenance(fill_image_queue)
+
     # Initialize flask server
     app = Flask(__name__)
     app.register_blueprint(bpo.api.blueprint)
     if return_app:
         return app
+    # Requests get handled in parallel threads, so a slow upload does not
+    # block other callbacks. The callbacks only save the uploaded files and
+    # let bpo.helpers.worker do the rest one task at a time.
     app.run(host=bpo.config.args.host, port=bpo.config.args.port,
-            threaded=False)
+            threaded=not bpo.config.args.single_threaded)
 
 
 def stop():
     """ Clean up after running the BPO Server. Used in the testsuite. """
     bpo.images.queue.timer_stop()
+    bpo.helpers.worker.stop()
+    bpo.ui.update_thread_stop()
 
 
 if __name__ == "__main__":
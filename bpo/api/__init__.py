@@ -4,6 +4,7 @@
 import flask
 import bpo.config.const
 import bpo.db
+import bpo.helpers.upload
 
 blueprint = flask.Blueprint("bpo_api", __name__)
 
@@ -65,3 +66,24 @@ def get_file(request, filename):
         if storage.filename == filename:
             return storage
     raise ValueError("Missing file " + filename + " in payload.")
+
+
+def save_files(request, path, check_filename):
+    """ Store the files attached to a job callback in path. They are either
+        attached as multipart/form-data, or were uploaded in chunks before
+        and the callback has a JSON payload listing them:
+        {"files": ["first.img.xz", ...]}
+        :param check_filename: see bpo.helpers.upload.save_files()
+        :returns: list of stored filenames """
+    if not request.is_json:
+        return bpo.helpers.upload.save_files(request.environ, path,
+                                             check_filename)
+
+    job_id = get_header(request, "Job-Id")
+    payload = request.get_json()
+    filenames = payload.get("files") if isinstance(payload, dict) else None
+    if not isinstance(filenames, list) or \
+            not all(isinstance(f, str) for f in filenames):
+        raise ValueError(f"Invalid list of files: {filenames}")
+    return bpo.helpers.upload.save_staged_files(job_id, filenames, path,
+                                                check_filename)
@@ -2,7 +2,6 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 import datetime
-import logging
 import os
 
 from flask import request
@@ -10,6 +9,8 @@ from bpo.helpers.headerauth import header_auth
 import bpo.api
 import bpo.config.args
 import bpo.db
+import bpo.helpers.job
+import bpo.helpers.worker
 import bpo.images
 import bpo.ui
 import bpo.ui.images
@@ -17,16 +18,11 @@ import bpo.ui.images
 blueprint = bpo.api.blueprint
 
 
-def get_files(request):
-    """ Get all attached files and verify their names. """
+def check_filename(filename):
+    """ Verify the name of an attached file. """
     pattern = bpo.config.const.images.pattern_file
-    ret = request.files.getlist("file[]")
-
-    for img in ret:
-        if not pattern.match(img.filename) or img.filename == "readme.html":
-            raise ValueError(f"Invalid filename: {img.filename}")
-
-    return ret
+    if not pattern.match(filename) or filename == "readme.html":
+        raise ValueError(f"Invalid filename: {filename}")
 
 
 def get_image(session, branch, device, ui):
@@ -56,20 +52,43 @@ def job_callback_build_image():
     dir_name = get_dir_name(request)
     job_id = bpo.api.get_header(request, "Job-Id")
     ui = bpo.api.get_header(request, "Ui")
+    bpo.helpers.job.invalidate_status(job_id)
 
-    session = bpo.db.session()
-    image = get_image(session, branch, device, ui)
-    files = get_files(request)
+    # Check if the image is expected before saving the files
+    get_image(bpo.db.session(), branch, device, ui)
 
     # Create target dir
     path = bpo.images.path(branch, device, ui, dir_name)
     os.makedirs(path, exist_ok=True)
 
-    # Fill target dir
-    for img in files:
-        path_img = os.path.join(path, img.filename)
-        logging.info(f"Saving {path_img}")
-        img.save(path_img)
+    # Fill target dir (checksums get verified against the uploaded
+    # .sha256/.sha512 files before the files are renamed into place)
+    bpo.api.save_files(request, path, check_filename)
+
+    bpo.helpers.worker.enqueue("job_callback_build_image", branch=branch,
+                               device=device, ui=ui, dir_name=dir_name,
+                               job_id=job_id)
+    return "image received, kthxbye"
+
+
+def fail_build_image(branch, device, ui, dir_name, job_id):
+    """ Set the image to failed, if process_build_image() raised an exception
+        (see fail_build_package()). """
+    session = bpo.db.session()
+    image = bpo.db.get_image(session, branch, device, ui)
+    if not image or image.status != bpo.db.ImageStatus.building:
+        return
+
+    bpo.db.set_image_status(session, image, bpo.db.ImageStatus.failed, job_id)
+    bpo.ui.log_image(image, "job_update_image_status_failed")
+    bpo.repo.build()
+
+
+@bpo.helpers.worker.register("job_callback_build_image",
+                             on_failure=fail_build_image)
+def process_build_image(branch, device, ui, dir_name, job_id):
+    session = bpo.db.session()
+    image = get_image(session, branch, device, ui)
 
     # Update database (status, job_id, dir_name, date)
     bpo.db.set_image_status(session, image, bpo.db.ImageStatus.published,
@@ -85,4 +104,3 @@ def job_callback_build_image():
 
     # Start next build job
     bpo.repo.build()
-    return "image received, kthxbye"
@@ -9,44 +9,77 @@ from bpo.helpers.headerauth import header_auth
 import bpo.api
 import bpo.config.args
 import bpo.db
+import bpo.helpers.job
+import bpo.helpers.worker
+import bpo.repo.store
 import bpo.ui
 
 blueprint = bpo.api.blueprint
 
 
-def get_apks(request):
-    """ Get all attached apks and verify the file names. """
-    pattern = bpo.config.const.pattern_apk_name
-    ret = request.files.getlist("file[]")
-
-    for apk in ret:
-        if not pattern.match(apk.filename):
-            raise RuntimeError("Invalid filename: " + apk.filename)
-
-    return ret
+def check_filename(filename):
+    """ Verify the file name of an attached apk. """
+    if not bpo.config.const.pattern_apk_name.match(filename):
+        raise RuntimeError("Invalid filename: " + filename)
 
 
 @blueprint.route("/api/job-callback/build-package", methods=["POST"])
 @header_auth("X-BPO-Token", "job_callback")
 def job_callback_build_package():
     job_id = bpo.api.get_header(request, "Job-Id")
+    bpo.helpers.job.invalidate_status(job_id)
     session = bpo.db.session()
     package = bpo.api.get_package(session, request)
-    apks = get_apks(request)
 
     # Create WIP dir
     wip = (bpo.config.args.repo_wip_path + "/" + package.branch + "/" +
            package.arch)
     os.makedirs(wip, exist_ok=True)
 
-    # Save files to disk
-    for apk in apks:
-        path = wip + "/" + apk.filename
-        logging.info("Saving " + path)
-        apk.save(path)
+    # Save files to disk. They get renamed after writing, so the WorkerThread
+    # does not index incomplete apks while it processes another callback.
+    bpo.api.save_files(request, wip, check_filename)
+
+    bpo.helpers.worker.enqueue("job_callback_build_package",
+                               arch=package.arch, branch=package.branch,
+                               pkgname=package.pkgname,
+                               version=package.version, job_id=job_id)
+    return "package received, kthxbye"
+
+
+def fail_build_package(arch, branch, pkgname, version, job_id):
+    """ Set the package to failed, if process_build_package() raised an
+        exception (e.g. indexing the WIP repo failed). Otherwise it would stay
+        at building, and update_status() would set it to built later, because
+        the job was successful. Like other failed builds, it gets retried. """
+    session = bpo.db.session()
+    package = bpo.db.get_package(session, pkgname, arch, branch)
+    if not package or package.version != version or \
+            package.status != bpo.db.PackageStatus.building:
+        return
+
+    bpo.db.set_package_status(session, package, bpo.db.PackageStatus.failed,
+                              job_id)
+    bpo.ui.log_package(package, "job_update_package_status_failed")
+    bpo.repo.build()
+
+
+@bpo.helpers.worker.register("job_callback_build_package",
+                             on_failure=fail_build_package)
+def process_build_package(arch, branch, pkgname, version, job_id):
+    session = bpo.db.session()
+    package = bpo.db.get_package(session, pkgname, arch, branch)
+    if not package or package.version != version:
+        logging.warning(f"{branch}/{arch}/{pkgname}-{version}: package was"
+                        " changed or removed from the db after the callback,"
+                        " ignoring")
+        return
+
+    # Add new apks to the store, so publishing them only creates hardlinks
+    bpo.repo.store.add_repo(bpo.repo.wip.get_path(arch, branch))
 
     # Index and sign WIP APKINDEX
-    bpo.repo.wip.update_apkindex(package.arch, package.branch)
+    bpo.repo.wip.update_apkindex(arch, branch)
 
     # Change status to built
     bpo.db.set_package_status(session, package, bpo.db.PackageStatus.built,
@@ -56,4 +89,3 @@ def job_callback_build_package():
 
     # Build next package or publish repo after building all queued packages
     bpo.repo.build()
-    return "package received, kthxbye"
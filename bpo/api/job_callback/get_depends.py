@@ -3,12 +3,14 @@
 
 import collections
 import json
+import sqlalchemy
 from flask import request
 from bpo.helpers.headerauth import header_auth
 import bpo.api
 import bpo.config.args
 import bpo.db
 import bpo.helpers.job
+import bpo.helpers.worker
 import bpo.repo
 import bpo.repo.wip
 import bpo.ui
@@ -39,14 +41,20 @@ def update_or_insert_packages(session, payload, arch, branch):
         information except for the dependencies. These need to be set later,
         because that needs to happen after each package has an ID assigned.
         Otherwise we will get duplicates in the database (resulting in errors
-        from the unique pkgname-arch index). """
+        from the unique pkgname-arch index).
+
+        All existing packages of the arch and branch get loaded with one
+        query, new packages get inserted with one executemany statement. """
+    packages_db = bpo.db.get_packages_by_pkgname(session, arch, branch)
+    insert = []
+
     for package in payload:
         pkgname = package["pkgname"]
         version = package["version"]
         repo = package["repo"]
 
         # Find existing db entry if possible (update or insert logic)
-        package_db = bpo.db.get_package(session, pkgname, arch, branch)
+        package_db = packages_db.get(pkgname)
         if package_db:
             if package_db.version != version:
                 bpo.jobs.build_package.abort(package_db)
@@ -55,39 +63,64 @@ def update_or_insert_packages(session, payload, arch, branch):
             package_db.version = version
             package_db.repo = repo
         else:
-            package_db = bpo.db.Package(arch, branch, pkgname, version)
-        session.merge(package_db)
+            insert.append({"arch": arch,
+                           "branch": branch,
+                           "pkgname": pkgname,
+                           "version": version,
+                           "repo": repo,
+                           "status": bpo.db.PackageStatus.queued,
+                           "retry_count": 0})
+
+    if insert:
+        session.execute(bpo.db.Package.__table__.insert(), insert)
     session.commit()
 
 
 def update_package_depends(session, payload, arch, branch):
+    """ Compare the dependencies from the payload with the ones in the
+        database, and only rewrite the package_dependency rows of packages
+        where they have changed (with executemany statements). """
+    Package = bpo.db.Package
+    ids = dict(session.query(Package.pkgname, Package.id).
+               filter_by(arch=arch, branch=branch))
+    depends_db = bpo.db.get_depends_ids(session, arch, branch)
+    delete = []
+    insert = []
+
     for package in payload:
+        package_id = ids[package["pkgname"]]
 
-        # Build list of dependencies (DB objects)
-        depends = []
+        # Avoid complexity by only storing postmarketOS dependencies (which
+        # are all in the database at this point), and ignoring Alpine depends.
+        depends = set()
         for pkgname in package["depends"]:
+            if pkgname in ids:
+                depends.add(ids[pkgname])
+        depends = sorted(depends)
 
-            # Avoid complexity by only storing postmarketOS dependencies (which
-            # are all in the database at this point), and ignoring Alpine
-            # depends.
-            depend = bpo.db.get_package(session, pkgname, arch, branch)
-            if depend:
-                depends.append(depend)
-
-        # Write changes
-        package_db = bpo.db.get_package(session, package["pkgname"], arch,
-                                        branch)
-        package_db.depends = depends
-        session.merge(package_db)
+        if depends == depends_db.get(package_id, []):
+            continue
+        delete.append({"package_id_old": package_id})
+        for dependency_id in depends:
+            insert.append({"package_id": package_id,
+                           "dependency_id": dependency_id})
+
+    # Write changes
+    assoc = bpo.db.package_dependency
+    if delete:
+        package_id_old = sqlalchemy.bindparam("package_id_old")
+        session.execute(assoc.delete().where(assoc.c.package_id ==
+                                             package_id_old), delete)
+    if insert:
+        session.execute(assoc.insert(), insert)
     session.commit()
 
 
 def remove_deleted_packages_db(session, payload, arch, branch):
     """ Remove all packages from the database, that have been deleted from
-        pmaports.git
+        pmaports.git. The log entries and the deletions are written in one
+        transaction, and the UI gets updated once afterwards.
         :returns: True if packages were deleted, False otherwise """
-    ret = False
-
     # Sort payload by pkgname for faster lookups
     packages_payload = {}
     for package in payload:
@@ -96,20 +129,32 @@ def remove_deleted_packages_db(session, payload, arch, branch):
     # Iterate over packages in db
     packages_db = session.query(bpo.db.Package).filter_by(arch=arch,
                                                           branch=branch).all()
+    deleted = []
     for package_db in packages_db:
         # Keep entries, that are part of the depends payload
         if package_db.pkgname in packages_payload:
             continue
 
-        ret = True
-        bpo.ui.log_package(package_db, "package_removed_from_pmaports")
+        bpo.ui.log_package(package_db, "package_removed_from_pmaports",
+                           session=session)
+        deleted.append({"package_id_deleted": package_db.id})
+
+    if not deleted:
+        return False
+
+    # Delete packages and their package_dependency rows
+    Package = bpo.db.Package
+    assoc = bpo.db.package_dependency
+    package_id = sqlalchemy.bindparam("package_id_deleted")
+    session.execute(assoc.delete().where(
+        sqlalchemy.or_(assoc.c.package_id == package_id,
+                       assoc.c.dependency_id == package_id)), deleted)
+    session.execute(Package.__table__.delete().where(
+        Package.id == package_id), deleted)
+    session.commit()
 
-        # Delete package from db and commit this change, because we might write
-        # to the log in the next iteration. If we don't commit and write to the
-        # log, we get a "database is locked" error.
-        session.delete(package_db)
-        session.commit()
-    return ret
+    bpo.ui.update_later()
+    return True
 
 
 @blueprint.route("/api/job-callback/get-depends", methods=["POST"])
@@ -122,6 +167,13 @@ def job_callback_get_depends():
     for arch in bpo.config.const.branches[branch]["arches"]:
         payloads[arch] = get_payload(request, arch)
 
+    bpo.helpers.worker.enqueue("job_callback_get_depends", branch=branch,
+                               job_id=job_id, payloads=payloads)
+    return "warming up build servers..."
+
+
+@bpo.helpers.worker.register("job_callback_get_depends")
+def process_get_depends(branch, job_id, payloads):
     # Update packages in DB
     session = bpo.db.session()
     force_repo_update = False
@@ -140,4 +192,3 @@ def job_callback_get_depends():
     bpo.helpers.job.update_status()
 
     bpo.repo.build(force_repo_update)
-    return "warming up build servers..."
@@ -7,8 +7,10 @@ from bpo.helpers.headerauth import header_auth
 import bpo.api
 import bpo.config.args
 import bpo.db
+import bpo.helpers.worker
 import bpo.repo.symlink
 import bpo.repo.final
+import bpo.repo.store
 import bpo.ui
 
 blueprint = bpo.api.blueprint
@@ -40,10 +42,16 @@ def job_callback_sign_index():
     # FIXME: check if the index signing was expected
     save_apkindex(request)
 
+    bpo.helpers.worker.enqueue("job_callback_sign_index", arch=arch,
+                               branch=branch)
+    return "alright, rollin' out the new repo"
+
+
+@bpo.helpers.worker.register("job_callback_sign_index")
+def process_sign_index(arch, branch):
     bpo.ui.log("api_job_callback_sign_index", arch=arch, branch=branch)
 
     bpo.repo.final.update_from_symlink_repo(arch, branch)
     bpo.repo.wip.clean(arch, branch)
+    bpo.repo.store.clean()
     bpo.repo.final.publish(arch, branch)
-
-    return "alright, rollin' out the new repo"
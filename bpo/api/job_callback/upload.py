@@ -0,0 +1,55 @@
+# Copyright 2022 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Resumable chunked uploads of large files (images). helpers/submit.py
+    initializes each file, PUTs the missing chunks (possibly in parallel),
+    and then calls the regular job callback with a JSON payload like
+    {"files": ["first.img.xz", ...]} instead of a multipart/form-data one.
+    See bpo.api.save_files(). """
+
+from flask import request, jsonify
+from bpo.helpers.headerauth import header_auth
+import bpo.api
+import bpo.helpers.upload
+
+blueprint = bpo.api.blueprint
+
+
+def get_size(request):
+    """ Get the size of the whole file from the JSON payload ({"size": 123}).
+    """
+    payload = request.get_json()
+    size = payload.get("size") if isinstance(payload, dict) else None
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        raise ValueError(f"Invalid size: {size}")
+    return size
+
+
+def get_offset(request):
+    offset = bpo.api.get_header(request, "Offset")
+    if not offset.isdigit():
+        raise ValueError(f"Invalid X-BPO-Offset: {offset}")
+    return int(offset)
+
+
+@blueprint.route("/api/job-callback/upload/<filename>", methods=["POST"])
+@header_auth("X-BPO-Token", "job_callback")
+def job_callback_upload_init(filename):
+    """ Start or resume uploading a file.
+        :returns: {"chunks": [[offset, length], ...]} with the chunks that were
+                  uploaded already """
+    job_id = bpo.api.get_header(request, "Job-Id")
+    size = get_size(request)
+    chunks = bpo.helpers.upload.init_staged_file(job_id, filename, size)
+    return jsonify({"chunks": chunks})
+
+
+@blueprint.route("/api/job-callback/upload/<filename>", methods=["PUT"])
+@header_auth("X-BPO-Token", "job_callback")
+def job_callback_upload_chunk(filename):
+    job_id = bpo.api.get_header(request, "Job-Id")
+    offset = get_offset(request)
+    if request.content_length is None:
+        raise ValueError("Missing Content-Length")
+    bpo.helpers.upload.write_chunk(job_id, filename, offset, request.stream,
+                                   request.content_length)
+    return "chunk received, kthxbye"
@@ -1,14 +1,54 @@
 # Copyright 2022 Oliver Smith
 # SPDX-License-Identifier: AGPL-3.0-or-later
+import logging
+
+from flask import request
 import bpo.api
 import bpo.helpers.job
+import bpo.helpers.worker
 import bpo.repo
 
 blueprint = bpo.api.blueprint
 
 
+def get_job_id(request):
+    """ Get the job ID from the completion event that the job service sent
+        (JSON body like {"id": 1234, "status": "failed", ...}).
+        :returns: job ID, or None if the request has no (valid) event """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return None
+    job_id = payload.get("id")
+    if not isinstance(job_id, int) or isinstance(job_id, bool):
+        logging.warning("update-job-status: ignoring invalid job id:"
+                        f" {job_id}")
+        return None
+    return job_id
+
+
 @blueprint.route("/api/public/update-job-status", methods=["POST"])
 def public_update_job_status():
-    bpo.helpers.job.update_status()
-    bpo.repo.build()
+    # This endpoint is public, so don't trust the status in the event. Ask
+    # the job service about the job's status instead. Without job ID, check
+    # all building jobs.
+    job_id = get_job_id(request)
+    bpo.helpers.job.invalidate_status(job_id)
+
+    # Only add a task per job ID for jobs that are building, so anonymous
+    # requests with arbitrary IDs can't fill up the task queue. Other IDs
+    # (e.g. of a job that just started) fall back to checking all jobs.
+    kwargs = {}
+    if job_id is not None and bpo.helpers.job.is_building(job_id):
+        kwargs["job_id"] = job_id
+
+    # Run in the same thread as the job callbacks, so the status of a job
+    # that just started is not checked before its job ID is in the db
+    bpo.helpers.worker.enqueue("public_update_job_status", unique=True,
+                               **kwargs)
     return "done"
+
+
+@bpo.helpers.worker.register("public_update_job_status")
+def process_update_job_status(job_id=None):
+    bpo.helpers.job.update_status(job_id)
+    bpo.repo.build()
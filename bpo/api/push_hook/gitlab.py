@@ -8,6 +8,7 @@ from bpo.helpers.headerauth import header_auth
 import bpo.jobs.get_depends
 import bpo.api
 import bpo.db
+import bpo.helpers.worker
 
 blueprint = bpo.api.blueprint
 
@@ -81,27 +82,33 @@ def reset_failed_packages(pkgnames_commits, branch):
         bpo.ui.log_package(package, action, depend_pkgname, commit)
 
     session = bpo.db.session()
-    failed = session.query(bpo.db.Package).\
+    failed = bpo.db.query_packages(session).\
         filter_by(status=bpo.db.PackageStatus.failed).\
-        filter_by(branch=branch)
-    building = session.query(bpo.db.Package).\
+        filter_by(branch=branch).all()
+    building = bpo.db.query_packages(session).\
         filter_by(status=bpo.db.PackageStatus.building).\
-        filter_by(branch=branch)
+        filter_by(branch=branch).all()
 
+    # Find all packages to reset first, before committing the first change
+    # expires the eagerly loaded depends of the remaining packages
+    resets = []
     for package_status in [failed, building]:
         for package in package_status:
             if package.pkgname in pkgnames_commits:
                 commit = pkgnames_commits[package.pkgname]
-                reset_package(package, "api_push_reset_failed", commit)
+                resets += [(package, "api_push_reset_failed", commit, None)]
                 continue
 
             for pkg_depend in package.depends:
                 if pkg_depend.pkgname in pkgnames_commits:
                     commit = pkgnames_commits[pkg_depend.pkgname]
-                    reset_package(package, "api_push_reset_failed_depend",
-                                  commit, depend_pkgname=pkg_depend.pkgname)
+                    resets += [(package, "api_push_reset_failed_depend",
+                                commit, pkg_depend.pkgname)]
                     break
 
+    for package, action, commit, depend_pkgname in resets:
+        reset_package(package, action, commit, depend_pkgname)
+
 
 @blueprint.route("/api/push-hook/gitlab", methods=["POST"])
 @header_auth("X-Gitlab-Token", "push_hook_gitlab")
@@ -114,14 +121,20 @@ def push_hook_gitlab():
     if payload["object_kind"] != "push":
         abort(400, "Unknown object_kind")
 
+    pkgnames_commits = get_pkgnames_commits(payload)
+    bpo.helpers.worker.enqueue("push_hook_gitlab", payload=payload,
+                               branch=branch,
+                               pkgnames_commits=pkgnames_commits)
+    return "Triggered!"
+
+
+@bpo.helpers.worker.register("push_hook_gitlab")
+def process_push_hook_gitlab(payload, branch, pkgnames_commits):
     # Insert log entry
     bpo.ui.log("api_push_hook_gitlab", payload=payload, branch=branch)
 
     # Reset relevant failed packages
-    pkgnames_commits = get_pkgnames_commits(payload)
     reset_failed_packages(pkgnames_commits, branch)
 
     # Run depends job for all arches
     bpo.jobs.get_depends.run(branch)
-
-    return "Triggered!"
@@ -19,6 +19,10 @@ def job_service_local(parser):
     sub.add_argument("--pmbootstrap", dest="local_pmbootstrap",
                      help="path to local pmbootstrap.git checkout, the job"
                           " will run on a copy")
+    sub.add_argument("--workers", dest="local_workers", type=int,
+                     help="how many jobs can run at the same time. each"
+                          " additional worker uses its own pmbootstrap work"
+                          " dir in the temp path")
     return sub
 
 
@@ -36,12 +40,33 @@ def init():
     parser.add_argument("-a", "--auto-get-depends", action="store_true",
                         help="automatically get missing packages (don't wait"
                              " for the push hook from gitlab)")
+    parser.add_argument("--background-maintenance", action="store_true",
+                        help="start answering requests right away, and fix"
+                             " repo inconsistencies etc. after the restart in"
+                             " the background. job callbacks get processed"
+                             " once their branch and arch are fixed")
     parser.add_argument("-b", "--bind", dest="host",
                         help="host to listen on")
     parser.add_argument("-t", "--tokens",
                         help="path to tokens file, where hashes of generated"
                              " auth tokens are stored")
     parser.add_argument("-d", "--db-path", help="path to sqlite3 database")
+    parser.add_argument("--db-journal-mode",
+                        choices=["wal", "delete", "truncate", "persist"],
+                        help="sqlite3 journal mode. with wal, reading from"
+                             " the database does not block writing to it")
+    parser.add_argument("--db-synchronous",
+                        choices=["off", "normal", "full", "extra"],
+                        help="sqlite3 synchronous setting")
+    parser.add_argument("--db-busy-timeout", type=int,
+                        help="milliseconds to wait for another thread to"
+                             " finish writing to the database. Threads write"
+                             " one at a time, after waiting this long they"
+                             " write anyway and may fail with 'database is"
+                             " locked'")
+    parser.add_argument("--db-pool-size", type=int,
+                        help="amount of database connections that are kept"
+                             " open for reuse by the threads")
     parser.add_argument("-m", "--mirror", help="the final repository location,"
                         " where published and properly signed packages can be"
                         " found")
@@ -51,7 +76,15 @@ def init():
                              " in case the final repo was signed with an"
                              " invalid key. it may lead to unexpected package"
                              " deletion. do not use.")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="amount of processes for reading the metadata"
+                             " of apks that are not in the cache yet, and of"
+                             " threads for fixing repos after the restart")
     parser.add_argument("-p", "--port", type=int, help="port to listen on")
+    parser.add_argument("--single-threaded", action="store_true",
+                        help="answer one request at a time, instead of"
+                             " handling each request in its own thread"
+                             " (debug)")
     parser.add_argument("-r", "--repo-final-path",
                         help="where to create the final binary repository")
     parser.add_argument("-w", "--repo-wip-path",
@@ -59,6 +92,11 @@ def init():
                              " pmaports.git push (of one or more commits) is"
                              " built, then all WIP apks are moved to the final"
                              " repo path")
+    parser.add_argument("--repo-store-path",
+                        help="content-addressed store of apks: apks in the"
+                             " WIP and final repo paths are hardlinks to the"
+                             " files in here (must be on the same file"
+                             " system, otherwise apks get copied)")
     parser.add_argument("-i", "--images-path",
                         help="location of generated postmarketOS images")
     parser.add_argument("-o", "--html-out", help="directory, to which the html"
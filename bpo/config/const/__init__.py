@@ -42,6 +42,37 @@ no_build_strict = ["gcc*-*"]
 # How many build jobs can run in parallel (across all arches)
 max_parallel_build_jobs = 1
 
+# Update the html_out dir (index.html, badge.svg) at most once per this many
+# seconds, even if many log messages are written in the meantime
+ui_update_interval = 5
+
+# How many requests to the sourcehut API may run in parallel, when getting the
+# status of many jobs at once
+sourcehut_parallel_requests = 8
+
+# Seconds for which the status of a job gets cached, before asking the job
+# service again. The cached status of a job is dropped when a callback for the
+# job arrives.
+job_status_cache_ttl = 30
+
+# Seconds to wait for connecting to / getting an answer from the sourcehut API
+sourcehut_timeout_connect = 10
+sourcehut_timeout_read = 60
+
+# Retry failed sourcehut API requests this many times, waiting
+# backoff * 2^(retry - 1) seconds in between. Only connection errors get
+# retried for POST requests, so we don't start the same job twice.
+sourcehut_retries = 5
+sourcehut_retry_backoff = 1
+
+# Large files (images) get uploaded by helpers/submit.py in chunks of this many
+# bytes, so interrupted uploads can be resumed and chunks can be uploaded in
+# parallel. Staged chunks of uploads, that were not finished, get removed
+# after upload_staging_max_age seconds.
+upload_chunk_size = 64 * 1024 * 1024
+upload_parallel_chunks = 4
+upload_staging_max_age = 24 * 60 * 60
+
 # Automatically retry build (sometimes builds fail due to network errors, so
 # just retry a few times to make it more robust) (#58)
 retry_count_max = 2
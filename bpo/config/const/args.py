@@ -11,11 +11,16 @@ tokens = bpo.config.const.top_dir + "/.tokens.cfg"
 host = "127.0.0.1"
 port = 5000
 db_path = bpo.config.const.top_dir + "/bpo.db"
+db_journal_mode = "wal"
+db_synchronous = "normal"
+db_busy_timeout = 30000
+db_pool_size = 5
 job_service = "local"
 mirror = "http://mirror.postmarketos.org/postmarketos"
 temp_path = bpo.config.const.top_dir + "/_temp"
 repo_final_path = bpo.config.const.top_dir + "/_repo_final"
 repo_wip_path = bpo.config.const.top_dir + "/_repo_wip"
+repo_store_path = bpo.config.const.top_dir + "/_repo_store"
 images_path = bpo.config.const.top_dir + "/_images"
 html_out = bpo.config.const.top_dir + "/_html_out"
 auto_get_depends = False
@@ -24,12 +29,16 @@ url_repo_wip_http = "http://build.postmarketos.org/wip"
 url_repo_wip_https = "https://build.postmarketos.org/wip"
 url_images = os.getenv("BPO_URL_IMG", "https://images.postmarketos.org/bpo")
 force_final_repo_sign = False
+background_maintenance = False
+jobs = os.cpu_count() or 1
+single_threaded = False
 
 # Defaults (local)
 local_pmaports = os.path.realpath(bpo.config.const.top_dir +
                                   "/../pmbootstrap/aports")
 local_pmbootstrap = os.path.realpath(bpo.config.const.top_dir +
                                      "/../pmbootstrap")
+local_workers = 1
 
 # Defaults (sourcehut)
 sourcehut_user = "postmarketos"
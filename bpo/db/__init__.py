@@ -8,13 +8,18 @@
         session.add(log)
         session.commit() """
 
+import collections
 import enum
 import sys
 import json
 import logging
+import threading
 
 import sqlalchemy
+import sqlalchemy.event
+import sqlalchemy.pool
 import sqlalchemy.orm
+import sqlalchemy.orm.attributes
 import sqlalchemy.ext.declarative
 import sqlalchemy.sql
 from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, \
@@ -29,6 +34,12 @@ base = sqlalchemy.ext.declarative.declarative_base()
 session = None
 engine = None
 init_relationships_complete = False
+package_dependency = None
+
+# Held by the connection that is writing to the database, so only one thread
+# writes at a time (see begin_write())
+writer_lock = threading.Lock()
+writer_thread = None
 
 
 class PackageStatus(enum.Enum):
@@ -215,6 +226,50 @@ class Image(base):
         return ret
 
 
+class Task(base):
+    __tablename__ = "task"
+
+    # === DATABASE LAYOUT, DO NOT CHANGE! (read docs/db.md) ===
+    id = Column(Integer, primary_key=True)
+    date = Column(DateTime(timezone=True),
+                  server_default=sqlalchemy.sql.func.now())
+    name = Column(String)
+    payload = Column(Text)
+    # === END OF DATABASE LAYOUT ===
+
+    def __init__(self, name, payload):
+        """ :param name: see bpo.helpers.worker.register()
+            :param payload: arguments for the task function (dict) """
+        self.name = name
+        self.payload = json.dumps(payload)
+
+    def __repr__(self):
+        return f"({self.id}){self.name}"
+
+
+class ApkMetadata(base):
+    """ Cache for bpo.helpers.apk.get_metadata(). An entry is only valid, if
+        inode, size and mtime of the file at path did not change. """
+    __tablename__ = "apk_metadata"
+
+    # === DATABASE LAYOUT, DO NOT CHANGE! (read docs/db.md) ===
+    id = Column(Integer, primary_key=True)
+    path = Column(String)
+    inode = Column(Integer)
+    size = Column(Integer)
+    mtime_ns = Column(Integer)
+    data = Column(Text)
+
+    Index("apk_metadata:path", path, unique=True)
+    # === END OF DATABASE LAYOUT ===
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return f"({self.id}){self.path}"
+
+
 def init_relationships():
     # Only run this once!
     self = sys.modules[__name__]
@@ -240,6 +295,57 @@ def init_relationships():
                                         backref="required_by")
     # === END OF DATABASE LAYOUT ===
 
+    # Used for bulk queries of the dependencies, see get_depends_ids()
+    self.package_dependency = assoc
+
+
+def set_pragmas(dbapi_connection, connection_record):
+    """ Configure each new sqlite3 connection according to bpo.config.args.
+        WAL journal mode gets stored in the database file, the other settings
+        only last as long as the connection. """
+    args = bpo.config.args
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={args.db_journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={args.db_synchronous}")
+    cursor.execute(f"PRAGMA busy_timeout={int(args.db_busy_timeout)}")
+    cursor.close()
+
+
+def begin_write(conn, cursor, statement, parameters, context, executemany):
+    """ Wait until no other thread is writing to the database, before the
+        first write of a transaction. With the WAL journal, sqlite allows
+        only one writer anyway, but the other writers would fail with
+        'database is locked' once busy_timeout runs out. The lock is released
+        again with end_write(). """
+    global writer_thread
+
+    if conn.info.get("writer") or \
+            not statement.lstrip().upper().startswith(("INSERT", "UPDATE",
+                                                      "DELETE", "REPLACE")):
+        return
+    if writer_thread == threading.get_ident():
+        # Another session of this thread is writing already, don't wait for
+        # it forever (it would fail with 'database is locked', like before)
+        return
+
+    timeout = bpo.config.args.db_busy_timeout / 1000
+    if not writer_lock.acquire(timeout=timeout):
+        logging.warning("Another thread is writing to the database for more"
+                        f" than {timeout}s, writing without waiting for it")
+        return
+    writer_thread = threading.get_ident()
+    conn.info["writer"] = True
+
+
+def end_write(info):
+    """ Release the writer_lock after commit or rollback.
+        :param info: info dict of the connection """
+    global writer_thread
+
+    if info.pop("writer", False):
+        writer_thread = None
+        writer_lock.release()
+
 
 def init():
     """ Initialize db """
@@ -253,9 +359,29 @@ def init():
     self = sys.modules[__name__]
     url = "sqlite:///" + bpo.config.args.db_path
 
+    # Keep connections open for reuse, instead of the default for sqlite
+    # files (NullPool: open a new connection for each session). Readers and
+    # the single writer don't block each other with the WAL journal, writers
+    # wait for each other with writer_lock. Don't limit the overflow, as
+    # threads must not wait for a connection while holding a lock.
+    pool_args = {"poolclass": sqlalchemy.pool.QueuePool,
+                 "pool_size": bpo.config.args.db_pool_size,
+                 "max_overflow": -1}
+
     # Open database, upgrade, close, open again
     for before_upgrade in [True, False]:
-        self.engine = sqlalchemy.create_engine(url, connect_args=connect_args)
+        self.engine = sqlalchemy.create_engine(url, connect_args=connect_args,
+                                               **pool_args)
+        sqlalchemy.event.listen(self.engine, "connect", set_pragmas)
+        sqlalchemy.event.listen(self.engine, "before_cursor_execute",
+                                begin_write)
+        sqlalchemy.event.listen(self.engine, "commit",
+                                lambda conn: end_write(conn.info))
+        sqlalchemy.event.listen(self.engine, "rollback",
+                                lambda conn: end_write(conn.info))
+        sqlalchemy.event.listen(self.engine, "checkin",
+                                lambda dbapi_conn, record:
+                                end_write(record.info) if record else None)
         init_relationships()
         self.base.metadata.create_all(engine)
         self.session = sqlalchemy.orm.sessionmaker(bind=engine)
@@ -271,6 +397,42 @@ def get_package(session, pkgname, arch, branch):
     return result[0] if len(result) else None
 
 
+def get_packages_by_pkgname(session, arch, branch):
+    """ Load all packages of one arch and branch with one query.
+        :returns: {pkgname: bpo.db.Package, ...} """
+    result = session.query(bpo.db.Package).filter_by(arch=arch, branch=branch)
+    return {package.pkgname: package for package in result}
+
+
+def query_packages(session):
+    """ Query packages and load Package.depends of all results with one
+        additional SELECT, instead of one lazy SELECT per package. Use this
+        whenever the depends (or depends_built(), __repr__ etc.) of more than
+        one package are accessed.
+        :returns: sqlalchemy query, that can be filtered further """
+    return session.query(bpo.db.Package).\
+        options(sqlalchemy.orm.selectinload(bpo.db.Package.depends))
+
+
+def get_depends_ids(session, arch, branch):
+    """ Get the dependencies of all packages of one arch and branch with one
+        query, instead of loading Package.depends for each package.
+        :returns: {package_id: [dependency_id, ...], ...} """
+    assoc = bpo.db.package_dependency
+    result = session.query(assoc.c.package_id, assoc.c.dependency_id).\
+        join(bpo.db.Package, bpo.db.Package.id == assoc.c.package_id).\
+        filter(bpo.db.Package.arch == arch,
+               bpo.db.Package.branch == branch).\
+        order_by(assoc.c.package_id, assoc.c.dependency_id)
+
+    ret = {}
+    for package_id, dependency_id in result:
+        if package_id not in ret:
+            ret[package_id] = []
+        ret[package_id].append(dependency_id)
+    return ret
+
+
 def get_image(session, branch, device, ui):
     """ Get a branch:device:ui specific image, that is currently being
         processed (status is not finished). Unlike packages, we keep more than
@@ -287,8 +449,7 @@ def get_all_packages_by_status(session):
                   pkglist is a list of bpo.db.Package objects """
     ret = {}
     for status in bpo.db.PackageStatus:
-        ret[status.name] = session.query(bpo.db.Package).\
-            filter_by(status=status)
+        ret[status.name] = query_packages(session).filter_by(status=status)
     return ret
 
 
@@ -347,6 +508,57 @@ def set_image_status(session, image, status, job_id=None, dir_name=None,
     session.commit()
 
 
+def set_status_multiple(session, cls, transitions):
+    """ Change the status (and job_id) of many rows with one UPDATE ... WHERE
+        id IN (...) statement per new status and job_id. Unlike
+        set_package_status(), this does not commit, so the caller can add the
+        related Log rows to the session (bpo.ui.log_package(...,
+        session=session)) and commit everything in one transaction.
+        :param cls: bpo.db.Package or bpo.db.Image
+        :param transitions: list of (obj, status, job_id) tuples, job_id may
+                            be None to keep the current job_id. If an obj
+                            appears more than once, it ends up with the
+                            status of its last transition, like it would
+                            with set_package_status() called in order. """
+    # Collapse the transitions of each obj into its final status and job_id
+    final = collections.OrderedDict()
+    for obj, status, job_id in transitions:
+        if obj in final and job_id is None:
+            job_id = final[obj][1]
+        final[obj] = (status, job_id)
+
+    groups = collections.defaultdict(list)
+    for obj, (status, job_id) in final.items():
+        groups[(status, job_id)] += [obj]
+
+    chunk_size = 500  # stay below SQLITE_MAX_VARIABLE_NUMBER
+    for (status, job_id), objs in groups.items():
+        values = {"status": status}
+        if job_id:
+            values["job_id"] = job_id
+        for i in range(0, len(objs), chunk_size):
+            ids = [obj.id for obj in objs[i:i + chunk_size]]
+            session.query(cls).filter(cls.id.in_(ids)).\
+                update(values, synchronize_session=False)
+
+        # Update the objects without letting the session write them again
+        for obj in objs:
+            for key, value in values.items():
+                sqlalchemy.orm.attributes.set_committed_value(obj, key, value)
+
+
+def set_package_status_multiple(session, transitions):
+    """ :param transitions: list of (package, status, job_id) tuples, see
+                            set_status_multiple() """
+    set_status_multiple(session, Package, transitions)
+
+
+def set_image_status_multiple(session, transitions):
+    """ :param transitions: list of (image, status, job_id) tuples, see
+                            set_status_multiple() """
+    set_status_multiple(session, Image, transitions)
+
+
 def package_has_version(session, pkgname, arch, branch, version):
     count = session.query(bpo.db.Package).filter_by(arch=arch,
                                                     branch=branch,
@@ -2,20 +2,86 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 import collections
+import concurrent.futures
+import gzip
+import json
+import logging
+import multiprocessing
 import os
 import tarfile
 
+import bpo.config.args
+import bpo.db
+
+
+# Keys that may appear more than once in a .PKGINFO file
+pkginfo_keys_multiple = ["depend", "install_if", "provides", "replaces",
+                         "triggers"]
+
+# Keys that must appear only once, as the bpo server relies on them
+pkginfo_keys_unique = ["origin", "pkgver"]
+
 
 def get_pkginfo_lines(apk):
+    """ Read the .PKGINFO file from an apk. An apk consists of concatenated
+        gzip streams (signature, control, data), which together form one
+        tar archive. Read it as stream and stop right after .PKGINFO, so
+        only the first few kilobytes get decompressed instead of the whole
+        data segment.
+        :param apk: path to the apk file
+        :returns: list of \n-terminated lines as bytes """
     if not os.path.exists(apk):
         raise RuntimeError("File does not exist: " + apk)
 
-    if not tarfile.is_tarfile(apk):
+    try:
+        with open(apk, "rb") as handle_apk, \
+                gzip.GzipFile(fileobj=handle_apk) as handle_gz, \
+                tarfile.open(fileobj=handle_gz, mode="r|") as tar:
+            for member in tar:
+                if member.name == ".PKGINFO":
+                    with tar.extractfile(member) as handle:
+                        return handle.readlines()
+    except (OSError, EOFError, tarfile.TarError):
         raise RuntimeError("This apk is not a valid tar archive: " + apk)
 
-    with tarfile.open(apk, "r:gz") as tar:
-        with tar.extractfile(".PKGINFO") as handle:
-            return handle.readlines()
+    raise RuntimeError("Missing .PKGINFO in apk: " + apk)
+
+
+def parse_pkginfo(lines):
+    """ :param lines: list of \n-terminated lines as bytes from .PKGINFO file,
+                      as returned by get_pkginfo_lines()
+        :returns: ordered dict with all key/value pairs, values of keys in
+                  pkginfo_keys_multiple (and of other keys that were found
+                  more than once) are lists:
+                  {"pkgname": "hello-world",
+                   "pkgver": "1-r4",
+                   ...
+                   "depend": ["so:libc.musl-x86_64.so.1"],
+                   ...} """
+    ret = collections.OrderedDict()
+    for line in lines:
+        line = line.decode().rstrip("\n")
+        if line.startswith("#") or " = " not in line:
+            continue
+        key, value = line.split(" = ", 1)
+        if key in pkginfo_keys_multiple:
+            ret.setdefault(key, []).append(value)
+            continue
+        if key not in ret:
+            ret[key] = value
+            continue
+        if key in pkginfo_keys_unique:
+            raise RuntimeError("key " + key + " found twice in .PKGINFO")
+        if not isinstance(ret[key], list):
+            ret[key] = [ret[key]]
+        ret[key].append(value)
+    return ret
+
+
+def get_pkginfo(apk):
+    """ :param apk: path to apk file
+        :returns: all key/value pairs from .PKGINFO, see parse_pkginfo() """
+    return parse_pkginfo(get_pkginfo_lines(apk))
 
 
 def get_abuild_version(lines):
@@ -40,8 +106,11 @@ def get_abuild_version(lines):
     return line[prefix_len:-1]
 
 
-def get_metadata(apk):
+def get_metadata(apk, cached=False):
     """ :param apk: path to apk file
+        :param cached: return the metadata from the bpo.db.ApkMetadata cache
+                       if the file did not change, and store it there
+                       otherwise
         :returns: ordered dict with relevant metadata from .PKGINFO:
                   {"abuild_version": "3.5.0_rc1-r1",
                    "pkgver": "1-r3",
@@ -50,20 +119,142 @@ def get_metadata(apk):
               ($pkgver-r$pkgrel)!
         NOTE: entries appear in the same order, as they appear in the .PKGINFO.
     """
+    if cached:
+        return get_metadata_cached(apk)
+
     relevant_keys = ["origin", "pkgver"]
 
     ret = collections.OrderedDict()
     lines = get_pkginfo_lines(apk)
     ret["abuild_version"] = get_abuild_version(lines)
 
-    for line in lines:
-        line = line.decode()
-        for key in relevant_keys:
-            if not line.startswith(key + " = "):
-                continue
-            if key in ret:
-                raise RuntimeError("key " + key + " found twice in .PKGINFO"
-                                   " of apk file: " + apk)
-            value = line[len(key + " = "):-1]
+    try:
+        pkginfo = parse_pkginfo(lines)
+    except RuntimeError as e:
+        raise RuntimeError(f"{e} of apk file: {apk}")
+
+    for key, value in pkginfo.items():
+        if key in relevant_keys:
             ret[key] = value
     return ret
+
+
+def get_metadata_cached(apk):
+    """ Like get_metadata(), but only read the apk if its inode, size or mtime
+        changed since it was read the last time. """
+    return get_metadata_multiple([apk])[apk]
+
+
+def get_process_pool():
+    """ :returns: ProcessPoolExecutor with bpo.config.args.jobs processes for
+                  get_metadata_multiple(). The processes get started by a
+                  fork server, instead of forking the multithreaded bpo server
+                  (which could deadlock, e.g. on a lock held by another
+                  thread). """
+    context = multiprocessing.get_context("forkserver")
+    return concurrent.futures.ProcessPoolExecutor(bpo.config.args.jobs,
+                                                  mp_context=context)
+
+
+def get_metadata_multiple(apks, executor=None):
+    """ Get the metadata of multiple apks through the bpo.db.ApkMetadata
+        cache. Apks that are not cached or have changed are read in parallel,
+        with up to bpo.config.args.jobs processes, and the cache gets updated
+        with one commit afterwards. The cache has its own session, so nothing
+        else gets committed with it.
+        :param apks: list of paths to apk files
+        :param executor: process pool from get_process_pool() to use, instead
+                         of creating a new one (pass it when calling this
+                         function from multiple threads, so they share the
+                         processes)
+        :returns: {apk: metadata, ...}, metadata as returned by get_metadata()
+    """
+    session = bpo.db.session()
+    try:
+        return get_metadata_multiple_session(session, apks, executor)
+    finally:
+        session.close()
+
+
+def get_metadata_multiple_session(session, apks, executor):
+    """ Implementation of get_metadata_multiple(), with the session of the
+        cache. """
+    entries = {}
+    chunk_size = 500  # stay below SQLITE_MAX_VARIABLE_NUMBER
+    for i in range(0, len(apks), chunk_size):
+        chunk = apks[i:i + chunk_size]
+        for entry in session.query(bpo.db.ApkMetadata).\
+                filter(bpo.db.ApkMetadata.path.in_(chunk)):
+            entries[entry.path] = entry
+
+    ret = {}
+    stats = {}
+    for apk in apks:
+        try:
+            st = os.stat(apk)
+        except FileNotFoundError:
+            raise RuntimeError("File does not exist: " + apk)
+
+        entry = entries.get(apk)
+        if entry and (entry.inode, entry.size, entry.mtime_ns) == \
+                (st.st_ino, st.st_size, st.st_mtime_ns):
+            ret[apk] = json.loads(entry.data,
+                                  object_pairs_hook=collections.OrderedDict)
+        else:
+            stats[apk] = st
+
+    if not stats:
+        return ret
+
+    misses = list(stats.keys())
+    jobs = min(bpo.config.args.jobs, len(misses))
+    if jobs > 1:
+        logging.info(f"Reading metadata of {len(misses)} apks with {jobs}"
+                     " processes")
+        if executor:
+            results = executor.map(get_metadata, misses, chunksize=16)
+            metadata_misses = dict(zip(misses, results))
+        else:
+            with get_process_pool() as executor:
+                results = executor.map(get_metadata, misses, chunksize=16)
+                metadata_misses = dict(zip(misses, results))
+    else:
+        metadata_misses = {apk: get_metadata(apk) for apk in misses}
+
+    for apk, metadata in metadata_misses.items():
+        st = stats[apk]
+        entry = entries.get(apk)
+        if not entry:
+            entry = bpo.db.ApkMetadata(apk)
+        entry.inode = st.st_ino
+        entry.size = st.st_size
+        entry.mtime_ns = st.st_mtime_ns
+        entry.data = json.dumps(metadata)
+        session.add(entry)
+        ret[apk] = metadata
+    session.commit()
+    return ret
+
+
+def prune_metadata_cache(apks=None):
+    """ Remove bpo.db.ApkMetadata entries of files that don't exist anymore.
+        :param apks: list of paths to apk files that were removed, or None to
+                     check all entries """
+    session = bpo.db.session()
+    try:
+        query = session.query(bpo.db.ApkMetadata)
+        if apks is None:
+            entries = query.all()
+        else:
+            entries = []
+            chunk_size = 500  # stay below SQLITE_MAX_VARIABLE_NUMBER
+            for i in range(0, len(apks), chunk_size):
+                chunk = apks[i:i + chunk_size]
+                entries += query.filter(bpo.db.ApkMetadata.path.in_(chunk))\
+                    .all()
+        for entry in entries:
+            if not os.path.exists(entry.path):
+                session.delete(entry)
+        session.commit()
+    finally:
+        session.close()
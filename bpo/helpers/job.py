@@ -4,11 +4,18 @@
 import collections
 import importlib
 import logging
+import threading
+import time
 
 import bpo.config.args
+import bpo.config.const
 
 jobservice = None
 
+# Recently retrieved job statuses: {str(job_id): (time.monotonic(), status)}
+status_cache = {}
+status_cache_lock = threading.Lock()
+
 
 def get_job_service():
     global jobservice
@@ -71,8 +78,49 @@ def run(name, note, tasks, branch=None, arch=None, pkgname=None,
     return job_id
 
 
-def get_status_package(package):
-    result = get_job_service().get_status(package.job_id)
+def get_statuses(job_ids):
+    """ Get the status of multiple jobs with one (parallel) round of requests
+        to the job service. Statuses that were retrieved less than
+        job_status_cache_ttl seconds ago are taken from the cache.
+        :returns: {job_id: bpo.job_services.base.JobStatus, ...} """
+    ret = {}
+    missing = []
+    now = time.monotonic()
+    ttl = bpo.config.const.job_status_cache_ttl
+    with status_cache_lock:
+        for job_id in set(job_ids):
+            cached = status_cache.get(str(job_id))
+            if cached and now - cached[0] < ttl:
+                ret[job_id] = cached[1]
+            else:
+                missing += [job_id]
+
+    if not missing:
+        return ret
+
+    result = get_job_service().get_statuses(missing)
+    with status_cache_lock:
+        for job_id, status in result.items():
+            status_cache[str(job_id)] = (now, status)
+    ret.update(result)
+    return ret
+
+
+def invalidate_status(job_id=None):
+    """ Drop a job's status from the cache, because its callback arrived.
+        :param job_id: job ID, or None to drop the whole cache """
+    with status_cache_lock:
+        if job_id is None:
+            status_cache.clear()
+        else:
+            status_cache.pop(str(job_id), None)
+
+
+def get_status_package(package, result=None):
+    """ :param result: JobStatus of the package's job, if it was already
+                       retrieved (see get_statuses()) """
+    if result is None:
+        result = get_statuses([package.job_id])[package.job_id]
     status = bpo.job_services.base.JobStatus
 
     if result in [status.pending, status.queued, status.running]:
@@ -87,24 +135,38 @@ def get_status_package(package):
     raise RuntimeError(f"get_status_package: failed on job status: {result}")
 
 
-def update_status_package():
+def update_status_package(job_id=None):
+    """ :param job_id: only check the packages built by this job """
     logging.info("Checking if 'building' packages have failed or finished")
     building = bpo.db.PackageStatus.building
 
     session = bpo.db.session()
-    result = session.query(bpo.db.Package).filter_by(status=building).all()
+    result = session.query(bpo.db.Package).filter_by(status=building)
+    if job_id is not None:
+        result = result.filter_by(job_id=job_id)
+    result = result.all()
+    statuses = get_statuses([package.job_id for package in result])
+    transitions = []
     for package in result:
-        status_new = get_status_package(package)
+        status_new = get_status_package(package, statuses[package.job_id])
         if status_new == building:
             continue
-        bpo.db.set_package_status(session, package, status_new)
+        transitions += [(package, status_new, None)]
+    if not transitions:
+        return
+
+    bpo.db.set_package_status_multiple(session, transitions)
+    for package, status_new, _ in transitions:
         action = "job_update_package_status_" + status_new.name
-        bpo.ui.log_package(package, action)
+        bpo.ui.log_package(package, action, session=session)
     session.commit()
+    bpo.ui.update_later()
 
 
-def get_status_image(image):
-    result = get_job_service().get_status(image.job_id)
+def get_status_image(image, result=None):
+    """ :param result: see get_status_package() """
+    if result is None:
+        result = get_statuses([image.job_id])[image.job_id]
     status = bpo.job_services.base.JobStatus
 
     if result in [status.pending, status.queued, status.running]:
@@ -119,25 +181,53 @@ def get_status_image(image):
     raise RuntimeError(f"get_status_image: failed on job status: {result}")
 
 
-def update_status_image():
+def update_status_image(job_id=None):
+    """ :param job_id: only check the images built by this job """
     logging.info("Checking if 'building' images have failed or finished")
     building = bpo.db.ImageStatus.building
 
     session = bpo.db.session()
-    result = session.query(bpo.db.Image).filter_by(status=building).all()
+    result = session.query(bpo.db.Image).filter_by(status=building)
+    if job_id is not None:
+        result = result.filter_by(job_id=job_id)
+    result = result.all()
+    statuses = get_statuses([image.job_id for image in result])
+    transitions = []
     for image in result:
-        status_new = get_status_image(image)
+        status_new = get_status_image(image, statuses[image.job_id])
         if status_new == building:
             continue
-        bpo.db.set_image_status(session, image, status_new)
+        transitions += [(image, status_new, None)]
+    if not transitions:
+        return
+
+    bpo.db.set_image_status_multiple(session, transitions)
+    for image, status_new, _ in transitions:
         action = f"job_update_image_status_{status_new.name}"
-        bpo.ui.log_image(image, action)
+        bpo.ui.log_image(image, action, session=session)
     session.commit()
+    bpo.ui.update_later()
+
 
+def update_status(job_id=None):
+    """ Update the status of building packages and images from the job
+        service.
+        :param job_id: only update the packages and images of this job,
+                       instead of asking the job service about all of them
+    """
+    update_status_package(job_id)
+    update_status_image(job_id)
 
-def update_status():
-    update_status_package()
-    update_status_image()
+
+def is_building(job_id):
+    """ :returns: True if a package or image is being built by this job """
+    session = bpo.db.session()
+    for cls, building in [(bpo.db.Package, bpo.db.PackageStatus.building),
+                          (bpo.db.Image, bpo.db.ImageStatus.building)]:
+        if session.query(cls).filter_by(status=building,
+                                        job_id=job_id).count():
+            return True
+    return False
 
 
 def get_link(job_id):
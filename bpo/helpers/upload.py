@@ -0,0 +1,359 @@
+# Copyright 2022 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Save the files of multipart/form-data uploads (job callbacks) directly in
+    their target directory. By default, werkzeug spools uploads to a temporary
+    file in /tmp and FileStorage.save() copies them afterwards, so each byte
+    of a multi-gigabyte image got written twice. Here each file gets streamed
+    into a temporary file next to its target, the checksums are calculated
+    while writing, and it gets renamed into place after all files were
+    received and verified.
+
+    Large files can also be uploaded in chunks before the callback (see
+    bpo/api/job_callback/upload.py), so interrupted uploads can be resumed.
+    These get staged per job ID in temp_path until the callback moves them
+    into place with save_staged_files(). """
+
+import errno
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+import werkzeug.formparser
+
+import bpo.config.args
+import bpo.config.const
+
+# Checksums that get calculated for each uploaded file. If a file "{name}" is
+# uploaded together with "{name}.{algorithm}" (output of sha256sum etc.), the
+# checksum gets verified before saving the files.
+hash_algorithms = ["sha256", "sha512"]
+
+# Names of staged files, the callback checks them again with its own rules
+pattern_staged_filename = re.compile("^[A-Za-z0-9_+-][A-Za-z0-9._+-]*$")
+
+# Locked while initializing a staged file
+staging_lock = threading.Lock()
+
+# Temporary files of HashingFile objects that are still being written, so
+# remove_temp_files() does not remove them
+temp_files = set()
+temp_files_lock = threading.Lock()
+
+
+class HashingFile:
+    """ Temporary file in the target directory, which calculates the
+        checksums of all data written to it. Other methods (read, seek, ...)
+        are passed through to the file, as werkzeug needs them. """
+
+    def __init__(self, path):
+        """ :param path: where the file will be stored after commit() """
+        self.path = path
+        self.filename = os.path.basename(path)
+        with temp_files_lock:
+            fd, self.path_temp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                                  prefix=self.filename + ".",
+                                                  suffix=".tmp")
+            temp_files.add(self.path_temp)
+        try:
+            # Same permissions as FileStorage.save() with the usual umask, so
+            # the files can be served by the web server
+            os.fchmod(fd, 0o644)
+            self.handle = os.fdopen(fd, "w+b")
+        except Exception:
+            os.close(fd)
+            with temp_files_lock:
+                os.unlink(self.path_temp)
+                temp_files.discard(self.path_temp)
+            raise
+        self.hashes = {algorithm: hashlib.new(algorithm)
+                       for algorithm in hash_algorithms}
+
+    def __getattr__(self, name):
+        return getattr(self.handle, name)
+
+    def write(self, data):
+        for hash_obj in self.hashes.values():
+            hash_obj.update(data)
+        return self.handle.write(data)
+
+    def hexdigest(self, algorithm):
+        return self.hashes[algorithm].hexdigest()
+
+    def read_checksum(self):
+        """ :returns: the checksum stored in this file, if it is the output of
+                      sha256sum etc. ("{checksum}  {filename}") """
+        self.handle.seek(0)
+        content = self.handle.read().decode(errors="replace").split()
+        return content[0] if content else ""
+
+    def commit(self):
+        self.handle.close()
+        os.replace(self.path_temp, self.path)
+        with temp_files_lock:
+            temp_files.discard(self.path_temp)
+
+    def discard(self):
+        self.handle.close()
+        with temp_files_lock:
+            if os.path.exists(self.path_temp):
+                os.unlink(self.path_temp)
+            temp_files.discard(self.path_temp)
+
+
+class StagedFile:
+    """ File that was uploaded in chunks, with the same interface as
+        HashingFile. The checksums get calculated only when needed, as the
+        chunks may have arrived in any order. """
+
+    def __init__(self, path_staged, path):
+        self.path_staged = path_staged
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.hashes = None
+
+    def hexdigest(self, algorithm):
+        # Calculate all checksums while reading the file once
+        if self.hashes is None:
+            hashes = {algorithm: hashlib.new(algorithm)
+                      for algorithm in hash_algorithms}
+            with open(self.path_staged, "rb") as handle:
+                for block in iter(lambda: handle.read(1024 * 1024), b""):
+                    for hash_obj in hashes.values():
+                        hash_obj.update(block)
+            self.hashes = hashes
+        return self.hashes[algorithm].hexdigest()
+
+    def read_checksum(self):
+        with open(self.path_staged, "rb") as handle:
+            content = handle.read().decode(errors="replace").split()
+        return content[0] if content else ""
+
+    def commit(self):
+        try:
+            os.rename(self.path_staged, self.path)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+        # temp_path is on another file system: copy to a temporary file next
+        # to the target first, so the target gets replaced atomically
+        upload = HashingFile(self.path)
+        try:
+            with open(self.path_staged, "rb") as handle:
+                shutil.copyfileobj(handle, upload.handle, 1024 * 1024)
+            upload.commit()
+        finally:
+            upload.discard()
+        os.unlink(self.path_staged)
+
+
+def verify_checksums(files):
+    """ :param files: dict of {filename: HashingFile or StagedFile}
+        :raises ValueError: if a file's checksum does not match the one in its
+                            uploaded .sha256/.sha512 file """
+    for filename, upload in files.items():
+        for algorithm in hash_algorithms:
+            checksum_file = files.get(f"{filename}.{algorithm}")
+            if not checksum_file:
+                continue
+            if checksum_file.read_checksum() != upload.hexdigest(algorithm):
+                raise ValueError(f"Invalid {algorithm} checksum: {filename}")
+
+
+def save_files(environ, path, check_filename):
+    """ Parse the "file[]" fields of a multipart/form-data request and store
+        the files in path. Existing files get replaced.
+        :param environ: WSGI environment of the request (request.environ), the
+                        request body must not have been read yet
+        :param path: target directory, must exist
+        :param check_filename: function that gets called with each filename
+                               before anything is written, and raises an
+                               exception if it is invalid
+        :returns: list of stored filenames """
+    uploads = []
+
+    def stream_factory(total_content_length, content_type, filename,
+                       content_length=None):
+        if not filename:
+            raise ValueError("Missing filename of uploaded file")
+        check_filename(filename)
+        ret = HashingFile(os.path.join(path, filename))
+        uploads.append(ret)
+        return ret
+
+    try:
+        _, _, files = werkzeug.formparser.parse_form_data(
+            environ, stream_factory=stream_factory, silent=False)
+
+        received = {}
+        for storage in files.getlist("file[]"):
+            received[storage.stream.filename] = storage.stream
+        verify_checksums(received)
+
+        for upload in received.values():
+            logging.info(f"Saving {upload.path}")
+            upload.commit()
+    finally:
+        # Remove temp files of failed uploads, and of files that were not
+        # uploaded as "file[]"
+        for upload in uploads:
+            upload.discard()
+
+    return list(received.keys())
+
+
+def get_staging_path(job_id, filename=None):
+    """ :param job_id: from the X-BPO-Job-Id header
+        :param filename: name of the staged file, or None
+        :returns: path to the staging dir of the job, or to the staged file
+                  (the dir containing its chunk markers is path + ".chunks")
+    """
+    if not job_id.isdigit():
+        raise ValueError(f"Invalid job ID: {job_id}")
+    ret = f"{bpo.config.args.temp_path}/upload/{job_id}"
+    if filename is None:
+        return ret
+    if not pattern_staged_filename.match(filename) or \
+            filename.endswith(".chunks"):
+        raise ValueError(f"Invalid filename: {filename}")
+    return f"{ret}/{filename}"
+
+
+def get_chunks(job_id, filename):
+    """ :returns: sorted list of [offset, length] of all chunks that were
+                  written completely """
+    path_chunks = get_staging_path(job_id, filename) + ".chunks"
+    ret = []
+    if os.path.exists(path_chunks):
+        for marker in os.listdir(path_chunks):
+            offset, length = marker.split("-")
+            ret.append([int(offset), int(length)])
+    return sorted(ret)
+
+
+def is_complete(chunks, size):
+    """ :param chunks: as returned by get_chunks()
+        :returns: True if the chunks cover all bytes of the file """
+    pos = 0
+    for offset, length in chunks:
+        if offset > pos:
+            return False
+        pos = max(pos, offset + length)
+    return pos >= size
+
+
+def remove_old_staging():
+    """ Remove staged files of jobs that did not finish their upload. """
+    path = f"{bpo.config.args.temp_path}/upload"
+    if not os.path.exists(path):
+        return
+    max_age = bpo.config.const.upload_staging_max_age
+    for job_id in os.listdir(path):
+        path_job = f"{path}/{job_id}"
+        if os.path.getmtime(path_job) < time.time() - max_age:
+            logging.info(f"Removing old staged upload: {path_job}")
+            shutil.rmtree(path_job, ignore_errors=True)
+
+
+def remove_temp_files(path):
+    """ Remove temporary files of HashingFile objects below path, that were
+        left behind (e.g. when the bpo server was stopped during an upload).
+        Files of uploads that are still running are kept. """
+    if not os.path.exists(path):
+        return
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            if not filename.endswith(".tmp"):
+                continue
+            path_temp = os.path.join(root, filename)
+            with temp_files_lock:
+                if path_temp in temp_files or not os.path.exists(path_temp):
+                    continue
+                logging.info(f"Removing temporary file: {path_temp}")
+                os.unlink(path_temp)
+
+
+def init_staged_file(job_id, filename, size):
+    """ Prepare uploading a file in chunks. If the file was staged already with
+        the same size, the chunks written so far are kept, so the upload can
+        be resumed.
+        :param size: size of the whole file in bytes
+        :returns: chunks written so far, see get_chunks() """
+    remove_old_staging()
+    path = get_staging_path(job_id, filename)
+    path_chunks = path + ".chunks"
+
+    with staging_lock:
+        os.makedirs(path_chunks, exist_ok=True)
+        os.utime(os.path.dirname(path))
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            logging.info(f"Staging upload: {path} ({size} bytes)")
+            shutil.rmtree(path_chunks)
+            os.makedirs(path_chunks)
+            with open(path, "wb") as handle:
+                handle.truncate(size)
+
+    return get_chunks(job_id, filename)
+
+
+def write_chunk(job_id, filename, offset, stream, length):
+    """ Write one chunk of a file that was initialized with init_staged_file().
+        Chunks may be written in parallel and in any order.
+        :param offset: position of the chunk in the file
+        :param stream: to read the chunk's data from
+        :param length: size of the chunk in bytes """
+    path = get_staging_path(job_id, filename)
+    if not os.path.exists(path):
+        raise ValueError(f"Upload was not initialized: {filename}")
+    if offset < 0 or length < 0 or offset + length > os.path.getsize(path):
+        raise ValueError(f"Chunk is out of bounds: {filename}, offset={offset}"
+                         f", length={length}")
+
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        pos = 0
+        while pos < length:
+            block = stream.read(min(1024 * 1024, length - pos))
+            if not block:
+                raise ValueError(f"Incomplete chunk: {filename},"
+                                 f" offset={offset}, received {pos} of"
+                                 f" {length} bytes")
+            os.pwrite(fd, block, offset + pos)
+            pos += len(block)
+    finally:
+        os.close(fd)
+
+    # Mark the chunk as written
+    with open(f"{path}.chunks/{offset}-{length}", "w"):
+        pass
+
+
+def save_staged_files(job_id, filenames, path, check_filename):
+    """ Move files that were uploaded in chunks into path, like save_files().
+        :param filenames: names of the staged files
+        :returns: list of stored filenames """
+    staged = {}
+    for filename in filenames:
+        check_filename(filename)
+        path_staged = get_staging_path(job_id, filename)
+        if not os.path.exists(path_staged) or \
+                not is_complete(get_chunks(job_id, filename),
+                                os.path.getsize(path_staged)):
+            raise ValueError(f"Upload is incomplete: {filename}")
+        staged[filename] = StagedFile(path_staged,
+                                      os.path.join(path, filename))
+
+    verify_checksums(staged)
+
+    for upload in staged.values():
+        logging.info(f"Saving {upload.path}")
+        upload.commit()
+    shutil.rmtree(get_staging_path(job_id), ignore_errors=True)
+
+    return list(staged.keys())
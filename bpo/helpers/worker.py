@@ -0,0 +1,210 @@
+# Copyright 2022 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Run the expensive part of the job callbacks (indexing, updating the
+    database, starting the next jobs, updating the UI) in a separate thread,
+    so the callbacks can answer right after the uploaded files were saved.
+    Queued tasks are stored in the database, so they survive a restart of the
+    bpo server. """
+
+import json
+import logging
+import threading
+
+import bpo.db
+
+# Functions that can be queued with enqueue(), and functions that get called
+# if they raise an exception, see register()
+functions = {}
+failure_handlers = {}
+
+# Instance of WorkerThread (created on demand)
+thread = None
+
+# ID of the task that WorkerThread is running, or None. cond is used for
+# locking, and gets notified when new tasks were queued, a task is done or a
+# (branch, arch) was unblocked.
+running_id = None
+cond = threading.Condition()
+
+# Set of (branch, arch) tuples, for which queued tasks must not run yet,
+# because the startup maintenance is still fixing their repositories
+blocked = set()
+
+# Set to True while image tasks (with a "device" argument) must not run yet,
+# because the startup maintenance is still fixing the images
+blocked_images = False
+
+
+def register(name, on_failure=None):
+    """ Decorator for functions that can be queued with enqueue().
+        :param name: unique name of the task
+        :param on_failure: function that gets called with the same arguments,
+                           if the task raises an exception. The job callback
+                           has answered already at that point, so use this
+                           to mark the package/image as failed instead of
+                           losing the error. """
+    def decorator(f):
+        functions[name] = f
+        if on_failure:
+            failure_handlers[name] = on_failure
+        return f
+    return decorator
+
+
+def is_blocked(task):
+    """ :returns: True if the task's branch and arch (from its payload) are in
+                  blocked. Tasks without branch or arch are blocked if any
+                  branch or arch is blocked. Image tasks are also blocked
+                  while blocked_images is set. """
+    payload = json.loads(task.payload)
+    if blocked_images and "device" in payload:
+        return True
+    branch = payload.get("branch")
+    arch = payload.get("arch")
+    for blocked_branch, blocked_arch in blocked:
+        if branch in [None, blocked_branch] and arch in [None, blocked_arch]:
+            return True
+    return False
+
+
+def get_next_task(session):
+    """ :returns: the oldest task that is not blocked, or None """
+    for task in session.query(bpo.db.Task).order_by(bpo.db.Task.id):
+        if not is_blocked(task):
+            return task
+    return None
+
+
+class WorkerThread(threading.Thread):
+    """ Run queued tasks one at a time, in the order they were queued. """
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="WorkerThread", daemon=True)
+
+    def run_task(self, session, task):
+        logging.info(f"Running task: {task}")
+        kwargs = json.loads(task.payload)
+        try:
+            functions[task.name](**kwargs)
+        except Exception:
+            logging.exception(f"Task failed: {task}")
+            if task.name in failure_handlers:
+                try:
+                    failure_handlers[task.name](**kwargs)
+                except Exception:
+                    logging.exception(f"Failure handler failed: {task}")
+
+        session.delete(task)
+        session.commit()
+
+    def run(self):
+        global running_id
+
+        while True:
+            with cond:
+                if thread is not self:
+                    logging.debug("terminated")
+                    return
+                session = bpo.db.session()
+                task = get_next_task(session)
+                running_id = task.id if task else None
+                if not task:
+                    session.close()
+                    cond.notify_all()
+                    cond.wait()
+                    continue
+
+            self.run_task(session, task)
+
+
+def start():
+    """ Start the WorkerThread, if it is not running already. It will run all
+        tasks that are still queued in the database. """
+    global thread
+
+    with cond:
+        if thread:
+            return
+        thread = WorkerThread()
+        thread.start()
+
+
+def is_queued(session, name, kwargs=None):
+    """ :param kwargs: only consider tasks with these arguments
+        :returns: True if a task with this name is queued, and not running
+                  yet """
+    with cond:
+        result = session.query(bpo.db.Task).filter_by(name=name)
+        if running_id:
+            result = result.filter(bpo.db.Task.id != running_id)
+        if kwargs is None:
+            return result.count() > 0
+        for task in result:
+            if json.loads(task.payload) == kwargs:
+                return True
+        return False
+
+
+def enqueue(name, unique=False, **kwargs):
+    """ Store a task in the database and let the WorkerThread run it.
+        :param name: as passed to register()
+        :param unique: don't add the task, if the same task with the same
+                       arguments is queued already and not running yet
+        :param kwargs: arguments for the task function, must be serializable
+                       with json.dumps() """
+    session = bpo.db.session()
+    if unique and is_queued(session, name, kwargs):
+        logging.debug(f"Task is queued already: {name}")
+        return
+    session.add(bpo.db.Task(name, kwargs))
+    session.commit()
+
+    start()
+    with cond:
+        cond.notify_all()
+
+
+def block(branch, arch):
+    """ Don't run tasks for this branch and arch until unblock() is called.
+    """
+    with cond:
+        blocked.add((branch, arch))
+
+
+def unblock(branch, arch):
+    with cond:
+        blocked.discard((branch, arch))
+        cond.notify_all()
+
+
+def block_images():
+    """ Don't run image tasks until unblock_images() is called. """
+    global blocked_images
+
+    with cond:
+        blocked_images = True
+
+
+def unblock_images():
+    global blocked_images
+
+    with cond:
+        blocked_images = False
+        cond.notify_all()
+
+
+def wait():
+    """ Block until all queued tasks, that are not blocked, are done (used in
+        testsuite). """
+    with cond:
+        while thread and (running_id or get_next_task(bpo.db.session())):
+            cond.wait()
+
+
+def stop():
+    """ Let the WorkerThread terminate after the current task. """
+    global thread
+
+    with cond:
+        thread = None
+        cond.notify_all()
@@ -28,3 +28,10 @@ class JobService:
     def get_status(self, job_id_check):
         """ :returns: JobStatus """
         return JobStatus.failed
+
+    def get_statuses(self, job_ids):
+        """ Get the status of multiple jobs at once. Job services override
+            this if they can do it faster than calling get_status() for each
+            job.
+            :returns: {job_id: JobStatus, ...} """
+        return {job_id: self.get_status(job_id) for job_id in set(job_ids)}
@@ -1,45 +1,72 @@
 # Copyright 2022 Oliver Smith
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
-import copy
+import collections
 import logging
 import os
 import requests
 import shlex
 import subprocess
 import threading
-import time
 
 import bpo.config.args
 import bpo.db
 from bpo.job_services.base import JobService
 
 
-# Instance of LocalJobServiceThread (created on demand)
-thread = None
+# Instances of LocalJobServiceThread (created on demand, see
+# bpo.config.args.local_workers)
+threads = []
 
 # When starting a job, the current ID increases by 1
 job_id = 0
 
-# The job queue. Jobs get added in the main thread, the LocalJobServiceThread
-# starts queued jobs and updates their status. jobs_cond is used for locking.
-# jobs[id] = {"name": ...,
-#             "note": ...,
-#             "tasks": [...],
-#             "branch": ...,
-#             "status": "queued" | "running" | "success" | "failed"}
-# Set jobs to None to exit the LocalJobServiceThread (used in testsuite).
+# The job queue. Jobs get added in the main thread, each LocalJobServiceThread
+# takes the oldest queued job and updates its status. jobs_cond is used for
+# locking, and gets notified when a job was queued or the threads must stop.
+# jobs[id] = LocalJob
+# queued: IDs of queued jobs, oldest first
+# Set jobs to None to exit the LocalJobServiceThreads (used in testsuite).
 jobs = {}
+queued = collections.deque()
 jobs_cond = threading.Condition()
 
 
-class LocalJobServiceThread(threading.Thread):
-    """ Local jobs are running on the same machine, but in a different thread.
-        New jobs can be queued while another job is running. They will be
-        executed in sequence. """
+class LocalJob:
+    """ State of one local job. The tasks are dropped once the job is done,
+        only the status is needed afterwards. """
+    __slots__ = ["name", "note", "tasks", "branch", "status"]
+
+    def __init__(self, name, note, tasks, branch):
+        self.name = name
+        self.note = note
+        self.tasks = tasks
+        self.branch = branch
+        self.status = "queued"  # | "running" | "success" | "failed"
+
 
-    def __init__(self):
-        threading.Thread.__init__(self, name="LocalJobService")
+class LocalJobServiceThread(threading.Thread):
+    """ Local jobs are running on the same machine, but in different threads.
+        New jobs can be queued while other jobs are running. Each thread runs
+        one job at a time, in its own temp dir and pmbootstrap work dir. """
+
+    def __init__(self, worker_id=0):
+        name = "LocalJobService"
+        if worker_id:
+            name += f"_{worker_id}"
+        threading.Thread.__init__(self, name=name)
+        self.worker_id = worker_id
+
+        # The first worker uses the default pmbootstrap config and work dir,
+        # like before running multiple workers was possible
+        self.temp_path = bpo.config.args.temp_path + "/local_job"
+        self.pmbootstrap_config = ""
+        self.pmbootstrap_work = ""
+        if worker_id:
+            self.temp_path += f"_{worker_id}"
+            self.pmbootstrap_config = self.temp_path + "/pmbootstrap.cfg"
+            self.pmbootstrap_work = (bpo.config.args.temp_path +
+                                     f"/local_job_work_{worker_id}")
 
     def run_print(self, command):
         with open(self.log_path, "a") as handle:
@@ -58,17 +85,25 @@ class LocalJobServiceThread(threading.Thread):
             return False
 
     def setup_task(self, branch):
-        """ Setup temp_path with copy of pmaports.git/pmbootstrap.git and
-            remove locally built packages.
-
-            Optionally copy the WIP repository to the local packages dir, so we
+        """ Prepare temp_path for the next job. It is a workspace that gets
+            reused between jobs of the same worker: pmaports.git and
+            pmbootstrap.git are clones that share their objects with the
+            local checkouts, and only get reset to the wanted commit (plus the
+            uncommitted changes and untracked files of the local checkouts)
+            instead of being copied again. Everything else in temp_path is
+            removed.
+
+            Optionally sync the WIP repository to the local packages dir, so we
             can build packages depending on others, without actually firing up
             a second webserver when testing locally and making the whole
-            development / automated testing setup more complicated. When BPO is
-            using a different backend than the local one (e.g. sourcehut), the
-            WIP repository will not get copied over the local packages dir,
-            instead it will get added as regular HTTPS mirror."""
-        temp_path = bpo.config.args.temp_path + "/local_job"
+            development / automated testing setup more complicated. Only
+            packages that are new or changed since the last job get copied,
+            and locally built packages that are not in the WIP repository get
+            removed. When BPO is using a different backend than the local one
+            (e.g. sourcehut), the WIP repository will not get copied over the
+            local packages dir, instead it will get added as regular HTTPS
+            mirror."""
+        temp_path = self.temp_path
         pmaports = bpo.config.args.local_pmaports
         pmbootstrap = bpo.config.args.local_pmbootstrap
         token = bpo.config.const.test_tokens["job_callback"]
@@ -76,37 +111,107 @@ class LocalJobServiceThread(threading.Thread):
         repo_wip_key = bpo.config.const.repo_wip_keys + "/wip.rsa"
         uid = bpo.config.const.pmbootstrap_chroot_uid_user
         return """
-            # Remove old temp dir
+            # Check out $3 (default: HEAD) of git repository $1 in $2, and
+            # copy the uncommitted changes and untracked files of $1 if $3 is
+            # checked out there. $2 is reused from the previous job if
+            # possible. Branches that only exist in the remote of $1 are
+            # resolved via origin/$3, like "git checkout $3" would do.
+            sync_checkout() {
+                src="$1"
+                dst="$2"
+                ref="${3:-HEAD}"
+                commit="$(git -C "$src" rev-parse -q --verify \
+                        "$ref^{commit}" \
+                    || git -C "$src" rev-parse --verify \
+                        "origin/$ref^{commit}")"
+
+                if ! [ -e "$dst/.git" ] || \
+                        ! git -C "$dst" checkout -q -f --detach "$commit" \
+                        || ! git -C "$dst" clean -q -f -d -x; then
+                    sudo rm -rf "$dst"
+                    git clone -q --shared --no-checkout "$src" "$dst"
+                    git -C "$dst" checkout -q -f --detach "$commit"
+                fi
+
+                if [ "$(git -C "$src" rev-parse HEAD)" = "$commit" ]; then
+                    git -C "$src" diff --binary HEAD > "$dst.diff"
+                    if [ -s "$dst.diff" ]; then
+                        git -C "$dst" apply "$dst.diff"
+                    fi
+                    rm "$dst.diff"
+
+                    git -C "$src" ls-files -o --exclude-standard -z \
+                        | tar -C "$src" --null -T - -cf - \
+                        | tar -C "$dst" -xf -
+                fi
+            }
+
+            # Remove files of the previous job, except for the checkouts
             temp_dir=""" + shlex.quote(temp_path) + """
-            if [ -d "$temp_dir" ]; then
-                sudo rm -rf "$temp_dir"
-            fi
-
-            # Prepare temp dir
             mkdir -p "$temp_dir"
             cd "$temp_dir"
-            cp -r """ + shlex.quote(pmaports) + """ ./pmaports
-            cp -r """ + shlex.quote(pmbootstrap) + """ ./pmbootstrap
+            sudo find . -mindepth 1 -maxdepth 1 \
+                ! -name pmaports \
+                ! -name pmbootstrap \
+                -exec rm -rf {} +
+
+            # Prepare temp dir
+            branch=""" + shlex.quote(branch) + """
+            sync_checkout """ + shlex.quote(pmaports) + """ \
+                "$temp_dir/pmaports" "$branch"
+            sync_checkout """ + shlex.quote(pmbootstrap) + """ \
+                "$temp_dir/pmbootstrap"
             mkdir build.postmarketos.org
             cp -r """ + shlex.quote(bpo.config.const.top_dir) + """/helpers \
                     build.postmarketos.org
             echo """ + shlex.quote(token) + """ > ./token
-            pmbootstrap -q -y zap -p
 
-            # Switch branch and release channel
-            git -C pmaports checkout """ + shlex.quote(branch) + """
+            # Use separate pmbootstrap config and work dir (multiple workers)
+            if [ -n "$PMBOOTSTRAP_CONFIG" ]; then
+                work_default="$(./pmbootstrap/pmbootstrap.py -q config work)"
+                mkdir -p "$PMBOOTSTRAP_WORK"
+                cp "$work_default/version" "$PMBOOTSTRAP_WORK/version"
+                sed "s|^work = .*|work = $PMBOOTSTRAP_WORK|" \
+                    ~/.config/pmbootstrap.cfg > "$PMBOOTSTRAP_CONFIG"
+            fi
+
+            # Remove chroots (locally built packages get synced below)
+            pmbootstrap -q -y zap
+
+            # Release channel of the branch
             channel="$(grep "^channel=" pmaports/pmaports.cfg | cut -d= -f 2)"
 
-            # Copy WIP repo
-            branch=""" + shlex.quote(branch) + """
+            # Sync WIP repo
             work_path="$(pmbootstrap -q config work)"
             packages_path="$work_path/packages"
             repo_wip_path=""" + shlex.quote(repo_wip_path) + """
-            if [ -n "$branch" ] && [ -d "$repo_wip_path/$branch" ]; then
-                sudo mkdir -p "$packages_path/$channel"
-                sudo cp -r "$repo_wip_path/$branch/"* \
-                    "$packages_path/$channel"
+            wip="$repo_wip_path/$branch"
+            dest="$packages_path/$channel"
+            if [ -n "$branch" ] && [ -d "$wip" ]; then
+                sudo find "$packages_path" -mindepth 1 -maxdepth 1 \
+                    ! -name "$channel" \
+                    -exec rm -rf {} +
+                sudo mkdir -p "$dest"
+
+                # Remove packages that are not in the WIP repo (anymore)
+                sudo find "$dest" -type f | while read -r file; do
+                    if ! [ -e "$wip/${file#"$dest/"}" ]; then
+                        sudo rm "$file"
+                    fi
+                done
+
+                # Copy packages that are new or changed (other mtime)
+                (cd "$wip" && find . -type f) | while read -r file; do
+                    if ! [ -e "$dest/$file" ] || \
+                            [ "$wip/$file" -nt "$dest/$file" ] || \
+                            [ "$wip/$file" -ot "$dest/$file" ]; then
+                        sudo mkdir -p "$(dirname "$dest/$file")"
+                        sudo cp -p "$wip/$file" "$dest/$file"
+                    fi
+                done
                 sudo chown -R """ + shlex.quote(uid) + """ "$packages_path"
+            else
+                sudo rm -rf "$packages_path"
             fi
 
             # Use WIP repo key as final repo key (it's fine for local testing)
@@ -115,6 +220,7 @@ class LocalJobServiceThread(threading.Thread):
 
     def run_job(self, name, note, tasks, branch, job_id):
         self.job_id = job_id
+        tasks = collections.OrderedDict(tasks)
 
         # Prepare log
         self.log_path = (bpo.config.args.temp_path + "/local_job_logs/" +
@@ -126,7 +232,7 @@ class LocalJobServiceThread(threading.Thread):
         tasks.move_to_end("setup", last=False)
 
         # Create temp dir
-        temp_path = bpo.config.args.temp_path + "/local_job"
+        temp_path = self.temp_path
         os.makedirs(temp_path, exist_ok=True)
 
         # Common header for each task
@@ -141,15 +247,18 @@ class LocalJobServiceThread(threading.Thread):
             export BPO_WIP_REPO_PATH={shlex.quote(wip_repo_path)}
             export BPO_WIP_REPO_URL="" # empty, because we copy it instead
             export BPO_WIP_REPO_ARG="" # empty, because we copy it instead
-            export BPO_TIMEOUT_READ="0.1"
-            export BPO_TIMEOUT_READ_IGNORE="1"
 
             export PMBOOTSTRAP_DIR={shlex.quote(temp_path)}"/pmbootstrap"
             export PMAPORTS_DIR={shlex.quote(temp_path)}"/pmaports"
+            export PMBOOTSTRAP_CONFIG={shlex.quote(self.pmbootstrap_config)}
+            export PMBOOTSTRAP_WORK={shlex.quote(self.pmbootstrap_work)}
 
             cd {shlex.quote(temp_path)}
 
             pmbootstrap() {{
+                if [ -n "$PMBOOTSTRAP_CONFIG" ]; then
+                    set -- -c "$PMBOOTSTRAP_CONFIG" "$@"
+                fi
                 "$PMBOOTSTRAP_DIR"/pmbootstrap.py \\
                         --aports "$PMAPORTS_DIR" \\
                         "$@"
@@ -174,104 +283,101 @@ class LocalJobServiceThread(threading.Thread):
                 return False
         return True
 
+    def get_next_job(self):
+        """ Wait until a job is queued, take the oldest one and set it to
+            running.
+            :returns: (job_id, job), or (None, None) if the thread must
+                      terminate """
+        with jobs_cond:
+            while jobs is not None and not queued:
+                jobs_cond.wait()
+            if jobs is None:
+                return None, None
+            job_id = queued.popleft()
+            job = jobs[job_id]
+            job.status = "running"
+            return job_id, job
+
     def run(self):
         global jobs
         global jobs_cond
 
         while True:
-            # Copy the jobs dict before iterating over it, so we don't block it
-            # while executing the job (and the other thread can happily queue
-            # new jobs in the meantime).
-            jobs_copy = None
+            job_id, job = self.get_next_job()
+            if job is None:
+                logging.debug("terminated")
+                break
+
+            # Only this thread accesses the job's data (not the status) while
+            # it is running, so it can be used without holding the lock
+            logging.info("Received job: " + job.name + " (" + job.note + ")")
+
+            # Run the job
+            success = self.run_job(job.name, job.note, job.tasks, job.branch,
+                                   job_id)
+            status = "success" if success else "failed"
+            logging.info("Job finished (" + status + ")")
+
+            # Set to success/failed
             with jobs_cond:
+                # Check if LocalJobService must terminate
                 if jobs is None:
                     logging.debug("terminated")
-                    jobs = {}
-                    jobs_cond.notify()
                     break
-                jobs_copy = copy.deepcopy(jobs)
-
-            # Execute all queued jobs, one at a time
-            for job_id, job_data in jobs_copy.items():
-                if job_data["status"] != "queued":
-                    continue
-
-                # Extract job data
-                name = job_data["name"]
-                note = job_data["note"]
-                tasks = job_data["tasks"]
-                branch = job_data["branch"]
-                logging.info("Received job: " + name + " (" + note + ")")
-
-                # Set to running
-                with jobs_cond:
-                    # Check if LocalJobService must terminate
-                    if jobs is None:
-                        break
-                    jobs[job_id]["status"] = "running"
-
-                # Run the job
-                success = self.run_job(name, note, tasks, branch, job_id)
-                status = "success" if success else "failed"
-                logging.info("Job finished (" + status + ")")
-
-                # Set to success/failed
-                with jobs_cond:
-                    # Check if LocalJobService must terminate
-                    if jobs is None:
-                        break
-                    jobs[job_id]["status"] = status
-
-                # Notify API of failure (as the sourcehut job service would do)
-                if status == "failed":
-                    logging.debug("Telling bpo server that the job failed")
-                    url = "http://{}:{}/api/public/update-job-status".format(
-                        bpo.config.args.host, bpo.config.args.port)
-                    try:
-                        # The server may take long to answer (#49). We don't
-                        # care about the answer here, so move on quickly.
-                        requests.post(url, timeout=0.01)
-                    except requests.exceptions.ReadTimeout:
-                        logging.debug("BPO server takes long to answer,"
-                                      " moving on...")
-                        pass
-
-            # Sleep before trying to find new jobs
-            time.sleep(0.01)
+                job.status = status
+                job.tasks = None
+
+            # Notify API of failure (as the sourcehut job service would do)
+            if status == "failed":
+                logging.debug("Telling bpo server that the job failed")
+                url = "http://{}:{}/api/public/update-job-status".format(
+                    bpo.config.args.host, bpo.config.args.port)
+                try:
+                    # The server may take long to answer (#49). We don't
+                    # care about the answer here, so move on quickly.
+                    requests.post(url, json={"id": job_id,
+                                             "status": status},
+                                  timeout=0.01)
+                except requests.exceptions.ReadTimeout:
+                    logging.debug("BPO server takes long to answer,"
+                                  " moving on...")
+                    pass
 
 
 class LocalJobService(JobService):
 
     def run_job(self, name, note, tasks, branch):
-        global thread
+        global threads
         global job_id
         global jobs
         global jobs_cond
 
-        job_id += 1
+        # Jobs may get started from multiple threads
+        with jobs_cond:
+            job_id += 1
+            ret = job_id
 
         # Prepare log dir, clear possibly existing log file
         log_path = (bpo.config.args.temp_path + "/local_job_logs/" +
-                    str(job_id) + ".txt")
+                    str(ret) + ".txt")
         os.makedirs(os.path.dirname(log_path), exist_ok=True)
         with open(log_path, "w") as handle:
             handle.write("job queued\n")
 
         # Add job to queue
         with jobs_cond:
-            jobs[job_id] = {"name": name,
-                            "note": note,
-                            "tasks": tasks,
-                            "branch": branch,
-                            "status": "queued"}
+            jobs[ret] = LocalJob(name, note, tasks, branch)
+            queued.append(ret)
             jobs_cond.notify()
 
-        # Start thread
-        if not thread:
-            thread = LocalJobServiceThread()
-            thread.start()
+        # Start threads
+        with jobs_cond:
+            if not threads:
+                for worker_id in range(bpo.config.args.local_workers):
+                    threads.append(LocalJobServiceThread(worker_id))
+                    threads[-1].start()
 
-        return job_id
+        return ret
 
     def get_status(self, job_id_check):
         global job_id
@@ -285,36 +391,49 @@ class LocalJobService(JobService):
             return status.failed
 
         with jobs_cond:
-            result = jobs[job_id_check]["status"]
+            result = jobs[job_id_check].status
         return status[result]
 
+    def get_statuses(self, job_ids):
+        status = bpo.job_services.base.JobStatus
+        ret = {}
+        with jobs_cond:
+            for job_id_check in set(job_ids):
+                if job_id_check > job_id:
+                    ret[job_id_check] = status.failed
+                else:
+                    ret[job_id_check] = status[jobs[job_id_check].status]
+        return ret
+
     def get_link(self, job_id):
         return ("file://" + bpo.config.args.temp_path + "/local_job_logs/" +
                 str(job_id) + ".txt")
 
 
 def stop_thread():
-    global thread
+    global threads
     global job_id
     global jobs
     global jobs_cond
 
-    if thread is None:
+    if not threads:
         logging.debug("LocalJobService isn't running")
         return
 
-    # Set jobs to None, so LocalJobService stops
+    # Set jobs to None, so the LocalJobServiceThreads stop
     logging.debug("Stopping LocalJobService...")
     with jobs_cond:
-        thread = None
+        threads_stop = threads
+        threads = []
         jobs = None
-        jobs_cond.notify()
+        jobs_cond.notify_all()
 
-    # Wait until LocalJobService has stopped and sets jobs back to {}
-    logging.debug("Waiting until LocalJobService thread is stopped...")
-    while True:
-        time.sleep(0.01)
-        with jobs_cond:
-            if jobs == {}:
-                logging.debug("LocalJobService thread has stopped")
-                return
+    # Wait until all LocalJobServiceThreads have stopped
+    logging.debug("Waiting until LocalJobService threads are stopped...")
+    for thread in threads_stop:
+        if thread is not threading.current_thread():
+            thread.join()
+    with jobs_cond:
+        jobs = {}
+        queued.clear()
+    logging.debug("LocalJobService threads have stopped")
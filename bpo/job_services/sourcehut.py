@@ -2,10 +2,13 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 """ Job service for builds.sr.ht, see: https://man.sr.ht/builds.sr.ht """
 
+import concurrent.futures
 import logging
 import requests
+import requests.adapters
 import shlex
 import re
+import urllib3.util.retry
 
 import bpo.config.args
 import bpo.config.tokens
@@ -13,12 +16,50 @@ import bpo.db
 from bpo.job_services.base import JobService
 
 
+# requests.Session that keeps connections to the sourcehut API open (created
+# on demand)
+http_session = None
+
+
+def get_retry():
+    """ :returns: urllib3 Retry object, that retries failed GET requests """
+    const = bpo.config.const
+    kwargs = {"total": const.sourcehut_retries,
+              "backoff_factor": const.sourcehut_retry_backoff,
+              "status_forcelist": [429, 500, 502, 503, 504],
+              "raise_on_status": False}
+    try:
+        return urllib3.util.retry.Retry(allowed_methods=["GET"], **kwargs)
+    except TypeError:
+        # urllib3 < 1.26 (e.g. alpine 3.12) has the old parameter name
+        return urllib3.util.retry.Retry(method_whitelist=["GET"], **kwargs)
+
+
+def get_http_session():
+    global http_session
+
+    if not http_session:
+        const = bpo.config.const
+        retry = get_retry()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=const.sourcehut_parallel_requests,
+            max_retries=retry)
+        http_session = requests.Session()
+        http_session.mount("https://", adapter)
+    return http_session
+
+
 def api_request(path, payload=None, method="POST"):
     url = "https://builds.sr.ht/api/" + path
     headers = {"Authorization": "token " + bpo.config.tokens.sourcehut}
-    ret = requests.request(method, url=url, headers=headers, json=payload)
-    print("sourcehut response: " + ret.text)
+    timeout = (bpo.config.const.sourcehut_timeout_connect,
+               bpo.config.const.sourcehut_timeout_read)
+    ret = get_http_session().request(method, url=url, headers=headers,
+                                     json=payload, timeout=timeout)
+    logging.debug(f"sourcehut response: {method} {path}: {ret.status_code}"
+                  f" ({ret.elapsed.total_seconds():.2f}s)")
     if not ret.ok:
+        logging.error(f"sourcehut response body: {ret.text}")
         raise RuntimeError("sourcehut API request failed: " + url)
     return ret
 
@@ -71,7 +112,7 @@ def get_manifest(name, tasks, branch):
         """ + get_secrets_by_job_name(name) + """
         triggers:
         - action: webhook
-          condition: failure
+          condition: always
           url: """ + url_api + """/api/public/update-job-status
         tasks:
         - bpo_setup: |
@@ -110,7 +151,7 @@ class SourcehutJobService(JobService):
 
     def run_job(self, name, note, tasks, branch):
         manifest = get_manifest(name, tasks, branch)
-        print(manifest)
+        logging.debug("Job manifest:\n" + manifest)
         result = api_request("jobs", {"manifest": manifest,
                                       "note": note,
                                       "tags": [name],
@@ -126,6 +167,18 @@ class SourcehutJobService(JobService):
         logging.info("=> status: " + status.name)
         return status
 
+    def get_statuses(self, job_ids):
+        job_ids = list(set(job_ids))
+        if len(job_ids) < 2:
+            return super().get_statuses(job_ids)
+
+        # Run the blocking HTTPS requests in parallel
+        workers = min(len(job_ids),
+                      bpo.config.const.sourcehut_parallel_requests)
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            results = executor.map(self.get_status, job_ids)
+            return dict(zip(job_ids, results))
+
     def get_link(self, job_id):
         user = bpo.config.args.sourcehut_user
         return ("https://builds.sr.ht/~" + user + "/job/" + str(job_id))
@@ -32,6 +32,8 @@ def run(device, branch, ui):
 
     # Shell arguments
     arg_branch = shlex.quote(branch)
+    arg_chunk_parallel = bpo.config.const.upload_parallel_chunks
+    arg_chunk_size = bpo.config.const.upload_chunk_size
     arg_device = shlex.quote(device)
     arg_ln = shlex.quote(bpo.config.const.build_image_ln)
     arg_pass = shlex.quote(bpo.config.const.images.password)
@@ -188,6 +190,8 @@ def run(device, branch, ui):
             export BPO_PAYLOAD_IS_JSON="0"
             export BPO_PKGNAME=""
             export BPO_VERSION="$(cat img-date)"
+            export BPO_UPLOAD_CHUNK_SIZE={arg_chunk_size}
+            export BPO_UPLOAD_PARALLEL={arg_chunk_parallel}
 
             # Always run submit.py with exec, because when running locally, the
             # current_task.sh script can change before submit.py completes!
@@ -206,4 +210,4 @@ def run(device, branch, ui):
         image.retry_count += 1
     bpo.db.set_image_status(session, image, bpo.db.ImageStatus.building,
                             job_id)
-    bpo.ui.update(session)
+    bpo.ui.update_later()
@@ -38,7 +38,7 @@ def run(arch, pkgname, branch):
     if os.path.exists(apk):
         bpo.ui.log_package(package, "package_exists_in_wip_repo")
         bpo.db.set_package_status(session, package, bpo.db.PackageStatus.built)
-        bpo.ui.update(session)
+        bpo.ui.update_later()
         return False
 
     # Read WIP repo pub key
@@ -115,7 +115,7 @@ def run(arch, pkgname, branch):
     # Change status to building and save job_id
     bpo.db.set_package_status(session, package, bpo.db.PackageStatus.building,
                               job_id)
-    bpo.ui.update(session)
+    bpo.ui.update_later()
     return True
 
 
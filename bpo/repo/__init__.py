@@ -12,6 +12,7 @@ import bpo.helpers.apk
 import bpo.jobs.build_image
 import bpo.jobs.build_package
 import bpo.jobs.sign_index
+import bpo.repo.scheduler
 import bpo.repo.symlink
 import bpo.repo.tools
 import bpo.repo.wip
@@ -23,32 +24,7 @@ build_cond = threading.Condition()
 
 def next_package_to_build(session, arch, branch):
     """ :returns: pkgname """
-
-    # Get all packages for arch where status = failed and retries left
-    failed = bpo.db.PackageStatus.failed
-    retry_count_max = bpo.config.const.retry_count_max
-    result = session.query(bpo.db.Package)\
-                    .filter_by(arch=arch, branch=branch, status=failed)\
-                    .filter(bpo.db.Package.retry_count < retry_count_max)\
-                    .all()
-
-    # Get all packages for arch where status = queued
-    queued = bpo.db.PackageStatus.queued
-    result += session.query(bpo.db.Package)\
-                     .filter_by(arch=arch, branch=branch, status=queued)\
-                     .all()
-
-    if not len(result):
-        return None
-
-    for package in result:
-        if package.depends_built():
-            return package.pkgname
-
-    # Can't resolve (this is expected, if we only have packages left that
-    # depend on packages that are currently building.)
-    logging.debug("can't resolve remaining packages: " + str(result))
-    return None
+    return bpo.repo.scheduler.Scheduler(session, arch, branch).next_package()
 
 
 def next_image_to_build(session, branch):
@@ -119,8 +95,9 @@ def build_arch_branch(session, slots_available, arch, branch,
                                the images timer thread, see #98) """
     logging.info(branch + "/" + arch + ": starting new package build job(s)")
     started = 0
+    scheduler = bpo.repo.scheduler.Scheduler(session, arch, branch)
     while True:
-        pkgname = next_package_to_build(session, arch, branch)
+        pkgname = scheduler.next_package()
         if not pkgname:
             if not started:
                 if has_unfinished_builds(session, arch, branch):
@@ -140,6 +117,9 @@ def build_arch_branch(session, slots_available, arch, branch,
             if bpo.jobs.build_package.run(arch, pkgname, branch):
                 started += 1
                 slots_available -= 1
+            else:
+                # Skipped, because the apk was in the WIP repo already
+                scheduler.set_built(pkgname)
         else:
             break
     return started
@@ -230,7 +210,7 @@ def is_apk_origin_in_db(session, arch, branch, apk_path):
         :returns: True if the origin is in the db and has the same version,
                   False otherwise """
 
-    metadata = bpo.helpers.apk.get_metadata(apk_path)
+    metadata = bpo.helpers.apk.get_metadata(apk_path, True)
     pkgname = metadata["origin"]
     version = metadata["pkgver"]  # yes, this is actually the full version
     return bpo.db.package_has_version(session, pkgname, arch, branch, version)
@@ -6,7 +6,9 @@ import os
 import shutil
 
 import bpo.config.const
+import bpo.helpers.apk
 import bpo.repo.status
+import bpo.repo.store
 
 
 def get_path(arch, branch):
@@ -14,7 +16,7 @@ def get_path(arch, branch):
 
 
 def copy_new_apks(arch, branch):
-    logging.info(branch + "/" + arch + ": copying new apks from symlink to"
+    logging.info(branch + "/" + arch + ": linking new apks from symlink to"
                  " final repo")
     repo_final_path = get_path(arch, branch)
     repo_symlink_path = bpo.repo.symlink.get_path(arch, branch)
@@ -25,10 +27,10 @@ def copy_new_apks(arch, branch):
         src = os.path.realpath(repo_symlink_path + "/" + apk)
         dst = os.path.realpath(repo_final_path + "/" + apk)
         if src == dst:
-            logging.debug(apk + ": symlink points to final repo, not copying")
+            logging.debug(apk + ": symlink points to final repo, not linking")
             continue
-        logging.debug(apk + ": copying to final repo")
-        shutil.copy(src, dst)
+        logging.debug(apk + ": linking to final repo")
+        bpo.repo.store.link(src, dst)
 
 
 def copy_new_apkindex(arch, branch):
@@ -42,12 +44,16 @@ def delete_outdated_apks(arch, branch):
     logging.info(branch + "/" + arch + ": removing outdated apks")
     repo_final_path = get_path(arch, branch)
     repo_symlink_path = bpo.repo.symlink.get_path(arch, branch)
+    removed = []
 
     for apk in bpo.repo.get_apks(repo_final_path):
         if os.path.exists(repo_symlink_path + "/" + apk):
             continue
         logging.info(apk + ": does not exist in symlink repo, removing")
         os.unlink(repo_final_path + "/" + apk)
+        removed += [repo_final_path + "/" + apk]
+
+    bpo.helpers.apk.prune_metadata_cache(removed)
 
 
 def update_from_symlink_repo(arch, branch):
@@ -0,0 +1,115 @@
+# Copyright 2022 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Figure out which packages can be built next, based on a dependency graph
+    that is loaded once per arch and branch. This avoids querying all failed
+    and queued packages again (and lazy loading their depends) every time a
+    new build job gets started. """
+
+import heapq
+import logging
+
+import bpo.config.const
+import bpo.db
+
+
+class Scheduler:
+    """ Dependency graph of all packages of one arch and branch. For each
+        package that can be built, the amount of its depends that are not built
+        yet is counted (indegree). Packages with no missing depends are in the
+        ready heap, so picking the next package does not need any queries.
+
+        The order is the same as with the previous SQL based implementation:
+        first failed packages with retries left, then queued packages, each
+        sorted by package ID. """
+
+    def __init__(self, session, arch, branch):
+        """ Load the graph with a constant amount of queries.
+            :param session: return value of bpo.db.session() """
+        self.arch = arch
+        self.branch = branch
+
+        # {package_id: pkgname}
+        self.pkgnames = {}
+        # {pkgname: package_id}
+        self.ids = {}
+        # {package_id: bpo.db.PackageStatus}
+        self.status = {}
+        # {package_id: sort key}, only for packages that should be built
+        self.candidates = {}
+        # {package_id: amount of depends that are not built yet}
+        self.indegree = {}
+        # {dependency_id: [package_id, ...]}
+        self.required_by = {}
+        # heap of (sort key, package_id)
+        self.ready = []
+
+        failed = bpo.db.PackageStatus.failed
+        queued = bpo.db.PackageStatus.queued
+        retry_count_max = bpo.config.const.retry_count_max
+
+        Package = bpo.db.Package
+        result = session.query(Package.id, Package.pkgname, Package.status,
+                               Package.retry_count).\
+            filter_by(arch=arch, branch=branch)
+        for package_id, pkgname, status, retry_count in result:
+            self.pkgnames[package_id] = pkgname
+            self.ids[pkgname] = package_id
+            self.status[package_id] = status
+            self.indegree[package_id] = 0
+            if status == failed and (retry_count or 0) < retry_count_max:
+                self.candidates[package_id] = (0, package_id)
+            elif status == queued:
+                self.candidates[package_id] = (1, package_id)
+
+        depends = bpo.db.get_depends_ids(session, arch, branch)
+        for package_id, dependency_ids in depends.items():
+            for dependency_id in dependency_ids:
+                if dependency_id not in self.required_by:
+                    self.required_by[dependency_id] = []
+                self.required_by[dependency_id].append(package_id)
+                if not self.is_built(dependency_id):
+                    self.indegree[package_id] += 1
+
+        for package_id, key in self.candidates.items():
+            if not self.indegree[package_id]:
+                self.ready.append((key, package_id))
+        heapq.heapify(self.ready)
+
+    def is_built(self, package_id):
+        return self.status.get(package_id) in [bpo.db.PackageStatus.built,
+                                               bpo.db.PackageStatus.published]
+
+    def next_package(self):
+        """ Take the next package, of which all depends are built, off the
+            ready heap.
+            :returns: pkgname or None """
+        if not self.ready:
+            if self.candidates:
+                # Can't resolve (this is expected, if we only have packages
+                # left that depend on packages that are currently building.)
+                pkgnames = [self.pkgnames[package_id]
+                            for package_id in self.candidates]
+                logging.debug(f"{self.branch}/{self.arch}: can't resolve"
+                              f" remaining packages: {pkgnames}")
+            return None
+
+        _, package_id = heapq.heappop(self.ready)
+        del self.candidates[package_id]
+        return self.pkgnames[package_id]
+
+    def set_built(self, pkgname):
+        """ Mark a package that was returned by next_package() as built (i.e.
+            it was already in the WIP repo), so packages depending on it may
+            become ready. """
+        package_id = self.ids.get(pkgname)
+        if package_id is None or self.is_built(package_id):
+            return
+
+        self.status[package_id] = bpo.db.PackageStatus.built
+        for required_by_id in self.required_by.get(package_id, []):
+            self.indegree[required_by_id] -= 1
+            if self.indegree[required_by_id] or \
+                    required_by_id not in self.candidates:
+                continue
+            key = self.candidates[required_by_id]
+            heapq.heappush(self.ready, (key, required_by_id))
@@ -1,12 +1,16 @@
 # Copyright 2022 Oliver Smith
 # SPDX-License-Identifier: AGPL-3.0-or-later
+import concurrent.futures
 import os
 import logging
 
 import bpo.db
 import bpo.helpers.apk
 import bpo.helpers.job
+import bpo.helpers.upload
+import bpo.helpers.worker
 import bpo.repo
+import bpo.repo.store
 
 
 def is_apk_broken(metadata):
@@ -15,6 +19,21 @@ def is_apk_broken(metadata):
     return False
 
 
+def set_package_status_log(session, transitions):
+    """ Change the status of multiple packages and log each change, with one
+        commit.
+        :param transitions: list of (package, status, job_id, action) tuples
+    """
+    if not transitions:
+        return
+    bpo.db.set_package_status_multiple(
+        session, [transition[:3] for transition in transitions])
+    for package, _, _, action in transitions:
+        bpo.ui.log_package(package, action, session=session)
+    session.commit()
+    bpo.ui.update_later()
+
+
 def remove_broken_apk(session, pkgname, version, arch, branch, apk_path):
     # Remove from disk
     bpo.ui.log("remove_broken_apk", arch=arch, branch=branch, pkgname=pkgname,
@@ -23,25 +42,25 @@ def remove_broken_apk(session, pkgname, version, arch, branch, apk_path):
 
     # Reset package status to queued
     queued = bpo.db.PackageStatus.queued
+    transitions = []
     package = bpo.db.get_package(session, pkgname, arch, branch)
     if package and package.version == version:
-        bpo.db.set_package_status(session, package, queued)
-        bpo.ui.log_package(package, "remove_broken_apk_reset_deleted")
+        transitions += [(package, queued, None,
+                         "remove_broken_apk_reset_deleted")]
 
     # Reset packages depending on the deleted apk from failed to queued
     failed = bpo.db.PackageStatus.failed
-    result = session.query(bpo.db.Package)\
-        .filter_by(arch=arch, branch=branch, status=failed)
+    result = bpo.db.query_packages(session)\
+        .filter_by(arch=arch, branch=branch, status=failed).all()
     for package_failed in result:
-        # There's probably a clever way to do this with sqlalchemy filters, but
-        # this is not performance critical
-        if package not in package_failed.depends:
-            continue
-        bpo.db.set_package_status(session, package_failed, queued)
-        bpo.ui.log_package(package_failed, "remove_broken_apk_reset_failed")
+        if package in package_failed.depends:
+            transitions += [(package_failed, queued, None,
+                             "remove_broken_apk_reset_failed")]
 
+    set_package_status_log(session, transitions)
 
-def fix_disk_vs_db(arch, branch, path, status, is_wip=False):
+
+def fix_disk_vs_db(arch, branch, path, status, is_wip=False, executor=None):
     """ Iterate over apks on disk, fix package status if it is not set to
         built/published but binary packages exist in the wip/final repo. Also
         remove obsolete packages from the wip repo. (Obsolete packages from the
@@ -54,11 +73,15 @@ def fix_disk_vs_db(arch, branch, path, status, is_wip=False):
         :param status: the package should have when the related apk file exists
                        e.g. bpo.db.PackageStatus.built
         :param is_wip: set to True when looking at the wip repo, False when
-                       looking at the final repo. """
+                       looking at the final repo.
+        :param executor: see bpo.helpers.apk.get_metadata_multiple() """
     session = bpo.db.session()
+    transitions = []
     apks = bpo.repo.get_apks(path)
+    metadata_all = bpo.helpers.apk.get_metadata_multiple(
+        [path + "/" + apk for apk in apks], executor)
     for apk in apks:
-        metadata = bpo.helpers.apk.get_metadata(path + "/" + apk)
+        metadata = metadata_all[path + "/" + apk]
         pkgname = metadata["origin"]
         version = metadata["pkgver"]  # metadata pkgver is really full version
 
@@ -79,43 +102,82 @@ def fix_disk_vs_db(arch, branch, path, status, is_wip=False):
                                branch=branch, pkgname=pkgname, version=version)
             continue
         if package.status != status:
-            bpo.db.set_package_status(session, package, status)
-            bpo.ui.log_package(package, "package_" + status.name)
+            transitions += [(package, status, None, "package_" + status.name)]
+
+    set_package_status_log(session, transitions)
 
 
 def fix_db_vs_disk(arch, branch):
     """ Iterate over packages in db, fix status of packages that are marked as
-        built/published but are missing on disk.
+        built/published but are missing on disk. Each repo dir gets listed
+        once and all changes are committed together.
         :param arch: architecture, e.g. "x86_64"
         :param branch: pmaports.git branch, e.g. "master" """
     session = bpo.db.session()
-    packages = session.query(bpo.db.Package).filter_by(arch=arch,
-                                                       branch=branch)
-    path_final = bpo.repo.final.get_path(arch, branch)
-    path_wip = bpo.repo.wip.get_path(arch, branch)
-
+    published = bpo.db.PackageStatus.published
+    built = bpo.db.PackageStatus.built
+    packages = session.query(bpo.db.Package).\
+        filter_by(arch=arch, branch=branch).\
+        filter(bpo.db.Package.status.in_([published, built])).all()
+    apks_final = set(bpo.repo.get_apks(bpo.repo.final.get_path(arch, branch)))
+    apks_wip = set(bpo.repo.get_apks(bpo.repo.wip.get_path(arch, branch)))
+
+    transitions = []
     for package in packages:
+        apk = f"{package.pkgname}-{package.version}.apk"
+        status = package.status
+
         # Missing published packages: change to "built"
-        if (package.status == bpo.db.PackageStatus.published and
-            not os.path.exists("{}/{}-{}.apk".format(path_final,
-                                                     package.pkgname,
-                                                     package.version))):
-            bpo.db.set_package_status(session, package,
-                                      bpo.db.PackageStatus.built)
-            bpo.ui.log_package(package, "missing_published_apk")
+        if status == published and apk not in apks_final:
+            status = built
+            transitions += [(package, status, None, "missing_published_apk")]
 
         # Missing built packages: change to "queued"
-        if (package.status == bpo.db.PackageStatus.built and
-            not os.path.exists("{}/{}-{}.apk".format(path_wip, package.pkgname,
-                                                     package.version))):
-            bpo.db.set_package_status(session, package,
-                                      bpo.db.PackageStatus.queued)
-            bpo.ui.log_package(package, "missing_built_apk")
+        if status == built and apk not in apks_wip:
+            status = bpo.db.PackageStatus.queued
+            transitions += [(package, status, None, "missing_built_apk")]
+
+    set_package_status_log(session, transitions)
+
+
+def fix_arch_branch(arch, branch, executor=None):
+    """ Fix the repositories of one arch and branch, then let the worker run
+        the tasks for them (see bpo.helpers.worker.block()).
+        :param executor: see bpo.helpers.apk.get_metadata_multiple() """
+    path_final = bpo.repo.final.get_path(arch, branch)
+    path_wip = bpo.repo.wip.get_path(arch, branch)
+
+    try:
+        # Iterate over apks in wip and final repo
+        logging.info(branch + "/" + arch + ": fix WIP apks vs DB status")
+        fix_disk_vs_db(arch, branch, path_wip, bpo.db.PackageStatus.built,
+                       True, executor)
+        logging.info(branch + "/" + arch + ": fix final apks vs DB status")
+        fix_disk_vs_db(arch, branch, path_final,
+                       bpo.db.PackageStatus.published, executor=executor)
+        bpo.repo.wip.update_apkindex(arch, branch)
+
+        # Remove temp files of uploads that were interrupted by a restart
+        bpo.helpers.upload.remove_temp_files(path_wip)
+
+        # Add apks to the store that are not in there yet (e.g. published
+        # before the store existed)
+        bpo.repo.store.add_repo(path_wip)
+        bpo.repo.store.add_repo(path_final)
+
+        # Iterate over packages in db
+        logging.info(branch + "/" + arch + ": fix DB status vs apks")
+        fix_db_vs_disk(arch, branch)
+    finally:
+        # Don't keep the tasks blocked forever if fixing failed
+        bpo.helpers.worker.unblock(branch, arch)
 
 
 def fix(limit_arch=None, limit_branch=None):
     """" Fix all inconsistencies between the database, the apk files on disk
-         and the running jobs.
+         and the running jobs. Each arch and branch gets fixed in its own
+         thread, with up to bpo.config.args.jobs threads. They share one
+         process pool for reading apks.
         :param limit_arch: architecture, e.g. "x86_64" (default: all)
         :param limit_branch: pmaports.git branch, e.g. "master"
                              (default: all) """
@@ -123,27 +185,28 @@ def fix(limit_arch=None, limit_branch=None):
     if limit_branch:
         branches = [limit_branch]
 
-    logging.info("Fixing inconsistencies between DB and files on disk")
+    arches_branches = []
     for branch in branches:
         arches = bpo.config.const.branches[branch]["arches"]
         if limit_arch:
             arches = [limit_arch]
         for arch in arches:
-            path_final = bpo.repo.final.get_path(arch, branch)
-            path_wip = bpo.repo.wip.get_path(arch, branch)
-
-            # Iterate over apks in wip and final repo
-            logging.info(branch + "/" + arch + ": fix WIP apks vs DB status")
-            fix_disk_vs_db(arch, branch, path_wip,
-                           bpo.db.PackageStatus.built, True)
-            logging.info(branch + "/" + arch + ": fix final apks vs DB status")
-            fix_disk_vs_db(arch, branch, path_final,
-                           bpo.db.PackageStatus.published)
-            bpo.repo.wip.update_apkindex(arch, branch)
-
-            # Iterate over packages in db
-            logging.info(branch + "/" + arch + ": fix DB status vs apks")
-            fix_db_vs_disk(arch, branch)
+            arches_branches += [(arch, branch)]
+
+    logging.info("Fixing inconsistencies between DB and files on disk")
+    jobs = max(1, min(bpo.config.args.jobs, len(arches_branches)))
+    with bpo.helpers.apk.get_process_pool() as pool, \
+            concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        futures = [executor.submit(fix_arch_branch, arch, branch, pool)
+                   for arch, branch in arches_branches]
+        for future in futures:
+            future.result()
+
+    # Forget metadata of apks that were removed
+    bpo.helpers.apk.prune_metadata_cache()
+
+    # Remove apks from the store that are not in any repository anymore
+    bpo.repo.store.clean()
 
     # Fix running job status
     bpo.helpers.job.update_status()
@@ -0,0 +1,134 @@
+# Copyright 2022 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Content-addressed store of apks. Apks in the WIP and final repositories
+    are hardlinks to files in the store, which are named after their sha256
+    checksum. Publishing an apk from the WIP repo to the final repo creates
+    another hardlink instead of copying the data, and identical apks (e.g. in
+    multiple branches) take up disk space only once. Files in the store that
+    are not linked from any repository anymore get removed by clean().
+
+    If the store is not on the same file system as the repositories, it does
+    not get used and apks are copied as before. """
+
+import hashlib
+import logging
+import os
+import shutil
+
+import bpo.config.args
+import bpo.repo
+
+
+def get_path():
+    return bpo.config.args.repo_store_path
+
+
+def get_blob_path(sha256):
+    return f"{get_path()}/{sha256[:2]}/{sha256}"
+
+
+def get_sha256(path):
+    hash_obj = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            hash_obj.update(block)
+    return hash_obj.hexdigest()
+
+
+def is_usable(path):
+    """ :param path: of a repository or file in it
+        :returns: True if the store is on the same file system as path, so
+                  hardlinks can be created """
+    os.makedirs(get_path(), exist_ok=True)
+    return os.stat(get_path()).st_dev == os.stat(path).st_dev
+
+
+def replace_with_link(src, dst):
+    """ Replace dst with a hardlink to src, atomically. """
+    temp = dst + ".link.tmp"
+    if os.path.exists(temp):
+        os.unlink(temp)
+    os.link(src, temp)
+    os.replace(temp, dst)
+
+
+def replace_with_copy(src, dst):
+    """ Replace dst with a copy of src, atomically. Writing to dst directly
+        would modify all other links to the same file in the store. """
+    temp = dst + ".copy.tmp"
+    shutil.copy(src, temp)
+    os.replace(temp, dst)
+
+
+def is_stored(path):
+    """ :returns: True if the apk is a hardlink to a file in the store. Apks
+                  that are not in the store have no other links. """
+    return os.stat(path).st_nlink > 1
+
+
+def add(path):
+    """ Add an apk to the store, if it is not in there yet. If the store has a
+        file with the same content already, path gets replaced with a link to
+        it, otherwise a link to path gets added to the store.
+        :returns: True on success, False if hardlinks can't be used """
+    if is_stored(path):
+        return True
+    if not is_usable(path):
+        return False
+
+    blob = get_blob_path(get_sha256(path))
+    try:
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        if os.path.exists(blob):
+            logging.debug(f"{path}: same content as {blob}, replacing with"
+                          " link")
+            replace_with_link(blob, path)
+        else:
+            os.link(path, blob)
+    except OSError as e:
+        logging.warning(f"{path}: failed to add to store ({e}), storing"
+                        " apks without hardlinks")
+        return False
+    return True
+
+
+def add_repo(path):
+    """ Add all apks of a repository to the store. """
+    if not os.path.exists(path):
+        return
+    if not is_usable(path):
+        logging.debug(f"{path}: not on the same file system as the store,"
+                      " not adding apks")
+        return
+    for apk in bpo.repo.get_apks(path):
+        if not add(path + "/" + apk):
+            return
+
+
+def link(src, dst):
+    """ Put an apk from one repository into another one, as hardlink to the
+        same file in the store, or as copy if that is not possible. """
+    if is_usable(os.path.dirname(dst)) and add(src):
+        try:
+            replace_with_link(src, dst)
+            return
+        except OSError as e:
+            logging.warning(f"{dst}: failed to create hardlink ({e}),"
+                            " copying instead")
+    replace_with_copy(src, dst)
+
+
+def clean():
+    """ Remove files from the store, that are not linked from any repository
+        anymore. """
+    path = get_path()
+    if not os.path.exists(path):
+        return
+    logging.debug("Cleaning apk store")
+    for prefix in os.listdir(path):
+        path_prefix = f"{path}/{prefix}"
+        for sha256 in os.listdir(path_prefix):
+            blob = f"{path_prefix}/{sha256}"
+            if os.stat(blob).st_nlink == 1:
+                logging.debug(f"{sha256}: not linked anymore, removing")
+                os.unlink(blob)
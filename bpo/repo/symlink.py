@@ -98,5 +98,7 @@ def create(arch, branch, force=False):
     logging.info("{}/{}: creating symlink repo".format(branch, arch))
     clean(arch, branch)
     link_to_all_packages(arch, branch, force)
-    bpo.repo.tools.index(arch, branch, "symlink", get_path(arch, branch))
+    old_index = bpo.repo.final.get_path(arch, branch) + "/APKINDEX.tar.gz"
+    bpo.repo.tools.index(arch, branch, "symlink", get_path(arch, branch),
+                         old_index)
     sign(arch, branch)
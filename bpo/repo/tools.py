@@ -60,9 +60,13 @@ def run(arch, branch, repo_name, cwd, cmd):
     subprocess.run(cmd, cwd=cwd, env=env, check=True)
 
 
-def index(arch, branch, repo_name, cwd):
+def index(arch, branch, repo_name, cwd, old_index=None):
     """ Sign a repository.
-        :param cwd: path to the repository """
+        :param cwd: path to the repository
+        :param old_index: path to an existing APKINDEX.tar.gz. apk.static
+                          reuses its entries for apks with the same name,
+                          version and size, that are older than the index,
+                          instead of reading them again. """
 
     # aports-turbo, hosted at pkgs.postmarketos.org, uses the description to
     # check if the APKINDEX was modified. Set it to the current date to make
@@ -71,5 +75,9 @@ def index(arch, branch, repo_name, cwd):
 
     cmd = ["apk.static", "-q", "index", "--output", "APKINDEX.tar.gz",
            "--rewrite-arch", arch,
-           "--description", description] + bpo.repo.get_apks(cwd)
+           "--description", description]
+    if old_index and os.path.exists(old_index):
+        # The old index is signed with a key that apk.static doesn't know
+        cmd += ["--allow-untrusted", "--index", old_index]
+    cmd += bpo.repo.get_apks(cwd)
     bpo.repo.tools.run(arch, branch, repo_name, cwd, cmd)
@@ -6,6 +6,7 @@ import os
 import subprocess
 
 import bpo.config.const
+import bpo.helpers.apk
 import bpo.repo
 import bpo.repo.final
 
@@ -43,7 +44,9 @@ def update_apkindex(arch, branch):
     path = get_path(arch, branch)
     if os.path.exists(path):
         logging.info(branch + "/" + arch + ": update WIP APKINDEX")
-        bpo.repo.tools.index(arch, branch, "WIP", path)
+        # Only read the apks that are not in the previous index yet
+        bpo.repo.tools.index(arch, branch, "WIP", path,
+                             path + "/APKINDEX.tar.gz")
         sign(arch, branch)
 
 
@@ -55,6 +58,7 @@ def clean(arch, branch):
     path_repo_wip = get_path(arch, branch)
     path_repo_final = bpo.repo.final.get_path(arch, branch)
     session = bpo.db.session()
+    removed = []
 
     for apk in bpo.repo.get_apks(path_repo_wip):
         apk_wip = path_repo_wip + "/" + apk
@@ -62,6 +66,7 @@ def clean(arch, branch):
         if os.path.exists(path_repo_final + "/" + apk):
             logging.debug(apk + ": found in final repo, delete from WIP repo")
             os.unlink(apk_wip)
+            removed += [apk_wip]
             continue
 
         # Find in db
@@ -71,5 +76,7 @@ def clean(arch, branch):
         else:
             logging.debug(apk + ": not found in db, delete from WIP repo")
             os.unlink(apk_wip)
+            removed += [apk_wip]
 
+    bpo.helpers.apk.prune_metadata_cache(removed)
     update_apkindex(arch, branch)
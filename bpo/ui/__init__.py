@@ -7,6 +7,7 @@ import os
 import logging
 import shutil
 import threading
+import time
 from sqlalchemy import func
 
 import bpo.config.const
@@ -16,6 +17,44 @@ import bpo.db
 env = None
 ui_update_cond = threading.Condition()
 
+# Set by update_later(), reset when html_out gets updated. update_later_cond
+# is used for locking.
+update_pending = False
+update_later_cond = threading.Condition()
+
+# Instance of UIUpdateThread (created on demand)
+update_thread = None
+
+
+class UIUpdateThread(threading.Thread):
+    """ Update html_out in the background, at most once per
+        bpo.config.const.ui_update_interval seconds, no matter how many log
+        messages were written in the meantime. """
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="UIUpdateThread", daemon=True)
+
+    def run(self):
+        while True:
+            with update_later_cond:
+                while not update_pending and update_thread is self:
+                    update_later_cond.wait()
+                if update_thread is not self:
+                    logging.debug("terminated")
+                    return
+
+            # Wait for more changes to pile up before updating
+            time.sleep(bpo.config.const.ui_update_interval)
+
+            with update_later_cond:
+                if update_thread is not self:
+                    logging.debug("terminated")
+                    return
+            try:
+                update_flush()
+            except Exception:
+                logging.exception("Failed to update html_out")
+
 
 def update_badge(session, pkgs, imgs):
     """ Update html_out/badge.svg
@@ -107,6 +146,45 @@ def update(session):
         update_badge(session, pkgs, imgs)
 
 
+def update_later():
+    """ Mark html_out as outdated, so it gets updated by the UIUpdateThread.
+        Use this instead of update() after changing the database, so a burst
+        of changes only leads to one update. """
+    global update_pending
+    global update_thread
+
+    with update_later_cond:
+        update_pending = True
+        if not update_thread:
+            update_thread = UIUpdateThread()
+            update_thread.start()
+        update_later_cond.notify()
+
+
+def update_flush():
+    """ Update html_out right away, if update_later() was called before. """
+    global update_pending
+
+    with update_later_cond:
+        if not update_pending:
+            return
+        update_pending = False
+
+    update(bpo.db.session())
+
+
+def update_thread_stop():
+    """ Stop the UIUpdateThread without waiting for it (used in testsuite).
+        Pending changes are not written to html_out. """
+    global update_pending
+    global update_thread
+
+    with update_later_cond:
+        update_pending = False
+        update_thread = None
+        update_later_cond.notify()
+
+
 def copy_static():
     """ Copy the static dir to _html_out, as much in an atomic operation as
         possible. """
@@ -137,37 +215,51 @@ def init():
     copy_static()
 
 
-def log(*args, **kwargs):
-    """ Write one log message and update the output. Do this after making
-        meaningful changes to the database, e.g. after a job callback was
-        executed. See bpo.db.Log.__init__() for the list of parameters.
+def log(*args, session=None, **kwargs):
+    """ Write one log message and mark the output as outdated (see
+        update_later()). Do this after making meaningful changes to the
+        database, e.g. after a job callback was executed. See
+        bpo.db.Log.__init__() for the list of parameters.
+
+        :param session: add the log message to this session, instead of
+                        writing it right away. This allows changing many rows
+                        and logging each change in one transaction: commit the
+                        session afterwards, then run update_later().
 
         NOTE: Make sure that you have committed all changes to any open
               sessions (run session.commit() after doing changes), otherwise
               you will get a "database is locked" error. """
     msg = bpo.db.Log(*args, **kwargs)
+    if session:
+        session.add(msg)
+        return
+
     session = bpo.db.session()
     session.add(msg)
     session.commit()
-    update(session)
+    update_later()
 
 
-def log_package(package, action, depend_pkgname=None, commit=None):
+def log_package(package, action, depend_pkgname=None, commit=None,
+                session=None):
     """ Convenience wrapper
-        :param package: bpo.db.Package object """
+        :param package: bpo.db.Package object
+        :param session: see log() """
     log(action=action, arch=package.arch, branch=package.branch,
         pkgname=package.pkgname, version=package.version,
         job_id=package.job_id, retry_count=package.retry_count,
-        depend_pkgname=depend_pkgname, commit=commit)
+        depend_pkgname=depend_pkgname, commit=commit, session=session)
 
 
-def log_image(image, action):
+def log_image(image, action, session=None):
     """ Convenience wrapper
-        :param image: bpo.db.Image object """
+        :param image: bpo.db.Image object
+        :param session: see log() """
     log(action=action,
         device=image.device,
         branch=image.branch,
         ui=image.ui,
         job_id=image.job_id,
         retry_count=image.retry_count,
-        dir_name=image.dir_name)
+        dir_name=image.dir_name,
+        session=session)
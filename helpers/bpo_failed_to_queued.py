@@ -62,13 +62,13 @@ def list_failed(packages, images):
 
 
 def change_to_queued(session, packages, images):
-    for package in packages:
-        package.status = bpo.db.PackageStatus.queued
-        session.merge(package)
+    queued = bpo.db.PackageStatus.queued
+    bpo.db.set_package_status_multiple(
+        session, [(package, queued, None) for package in packages])
 
-    for image in images:
-        image.status = bpo.db.ImageStatus.queued
-        session.merge(image)
+    queued = bpo.db.ImageStatus.queued
+    bpo.db.set_image_status_multiple(
+        session, [(image, queued, None) for image in images])
 
     session.commit()
 
@@ -78,9 +78,12 @@ def set_status(session, pkgnames, arch, branch, status):
             " packages: " + str(pkgnames))
 
     status = bpo.db.PackageStatus[status]
+    transitions = []
     for pkgname in pkgnames:
         package = bpo.db.get_package(session, pkgname, arch, branch)
-        bpo.db.set_package_status(session, package, status)
+        transitions += [(package, status, None)]
+    bpo.db.set_package_status_multiple(session, transitions)
+    session.commit()
 
     print("done!")
     print()
@@ -5,9 +5,11 @@
 # bpo runs this script in a job service (sourcehut builds, local) to return the
 # result (built package etc.) to the bpo server.
 
+import concurrent.futures
 import json
 import os
 import requests
+import time
 
 # Require environment vars
 for key in ["BPO_API_ENDPOINT",
@@ -56,12 +58,82 @@ headers = {"X-BPO-Arch": os.environ["BPO_ARCH"],
            "X-BPO-Ui": os.environ["BPO_UI"],
            "X-BPO-Version": os.environ["BPO_VERSION"]}
 
-# The server may take long to answer (#49). Hack for the testsuite until this
-# is resolved: set a timeout and ignore the ReadTimeout exception
+# Optional timeouts (the server answers right after saving the payload, the
+# processing happens afterwards in its worker thread)
 timeout_connect = float(os.environ.get("BPO_TIMEOUT_CONNECT", 0)) or None
 timeout_read = float(os.environ.get("BPO_TIMEOUT_READ", 0)) or None
 timeout = (timeout_connect, timeout_read)
 
+# Optional chunked upload: upload each file in chunks of this many bytes
+# before calling the job callback, resume interrupted uploads and retry failed
+# requests (0: send all files in the job callback request)
+chunk_size = int(os.environ.get("BPO_UPLOAD_CHUNK_SIZE", 0))
+chunk_parallel = int(os.environ.get("BPO_UPLOAD_PARALLEL", 4))
+retries = int(os.environ.get("BPO_UPLOAD_RETRIES", 5))
+
+
+def request_retry(method, url, headers_extra={}, **kwargs):
+    """ Send a request to the bpo server, retry on connection errors and
+        server errors. """
+    for attempt in range(retries + 1):
+        try:
+            response = requests.request(method, url,
+                                        headers={**headers, **headers_extra},
+                                        timeout=timeout, **kwargs)
+            if response.status_code < 500:
+                break
+            error = f"HTTP {response.status_code}"
+        except requests.exceptions.RequestException as e:
+            response = None
+            error = str(e)
+        if attempt < retries:
+            print(f"{method} {url} failed ({error}), retrying...")
+            time.sleep(2 ** attempt)
+
+    if response is None:
+        print(f"ERROR: {method} {url} failed: {error}")
+        exit(1)
+    if response.status_code > 399:
+        print("Error occurred:")
+        print(response.content.decode())
+        exit(1)
+    return response
+
+
+def upload_chunk(path, url_file, offset, length):
+    with open(path, "rb") as handle:
+        handle.seek(offset)
+        data = handle.read(length)
+    request_retry("PUT", url_file, data=data,
+                  headers_extra={"X-BPO-Offset": str(offset)})
+
+
+def upload_chunked(path):
+    """ Upload one file in chunks, skip chunks that the server has already
+        (from an interrupted previous attempt). """
+    filename = os.path.basename(path)
+    size = os.path.getsize(path)
+    url_file = (os.environ["BPO_API_HOST"] + "/api/job-callback/upload/" +
+                filename)
+
+    response = request_retry("POST", url_file, json={"size": size})
+    done = set(tuple(chunk) for chunk in response.json()["chunks"])
+    chunks = []
+    for offset in range(0, size, chunk_size):
+        length = min(chunk_size, size - offset)
+        if (offset, length) not in done:
+            chunks.append((offset, length))
+
+    print(f"Uploading {filename}: {len(chunks)} of"
+          f" {-(-size // chunk_size)} chunks")
+    with concurrent.futures.ThreadPoolExecutor(chunk_parallel) as executor:
+        futures = [executor.submit(upload_chunk, path, url_file, offset,
+                                   length)
+                   for offset, length in chunks]
+        for future in futures:
+            future.result()
+
+
 # Submit JSON
 if is_json:
     if len(files) > 1:
@@ -74,14 +146,17 @@ if is_json:
     data = json.loads(data)
 
     print("Sending JSON to: " + url)
-    try:
-        response = requests.post(url, json=data, headers=headers,
-                                 timeout=timeout)
-    except requests.exceptions.ReadTimeout:
-        if "BPO_TIMEOUT_READ_IGNORE" in os.environ:
-            print("hack for testsuite: ignore read timeout")
-            exit(0)
-        raise
+    response = requests.post(url, json=data, headers=headers, timeout=timeout)
+
+elif chunk_size:  # Upload blobs in chunks, then submit their names
+    for path in files:
+        upload_chunked(path)
+
+    # Not retried, the server moves the uploaded files away on success
+    filenames = [os.path.basename(path) for path in files]
+    print("Submitting uploaded files to: " + url)
+    response = requests.post(url, json={"files": filenames}, headers=headers,
+                             timeout=timeout)
 
 else:  # Submit blobs
     blobs = []
@@ -94,14 +169,8 @@ else:  # Submit blobs
                                  "application/octet-stream")))
 
     print("Uploading to: " + url)
-    try:
-        response = requests.post(url, files=blobs, headers=headers,
-                                 timeout=timeout)
-    except requests.exceptions.ReadTimeout:
-        if "BPO_TIMEOUT_READ_IGNORE" in os.environ:
-            print("hack for testsuite: ignore read timeout")
-            exit(0)
-        raise
+    response = requests.post(url, files=blobs, headers=headers,
+                             timeout=timeout)
 
 if response.status_code > 399:
     print("Error occurred:")
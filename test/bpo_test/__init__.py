@@ -18,6 +18,8 @@ import bpo  # noqa
 import bpo.config.const  # noqa
 import bpo.config.const.args  # noqa
 import bpo.config.args  # noqa
+import bpo.db  # noqa
+import bpo.helpers.job  # noqa
 import bpo.job_services.local  # noqa
 
 # Queue for passing test result between threads
@@ -30,13 +32,24 @@ def reset():
         of bpo.config.args, because this runs before bpo.config.args.init().
     """
     paths = [bpo.config.const.args.db_path,
+             bpo.config.const.args.db_path + "-shm",
+             bpo.config.const.args.db_path + "-wal",
              bpo.config.const.args.html_out,
              bpo.config.const.args.images_path,
              bpo.config.const.args.temp_path,
              bpo.config.const.args.repo_final_path,
              bpo.config.const.args.repo_wip_path,
+             bpo.config.const.args.repo_store_path,
              bpo.config.const.repo_wip_keys]
 
+    # Local job IDs start at 1 again
+    bpo.helpers.job.invalidate_status()
+
+    # Close pooled connections, so sessions of the previous test case don't
+    # keep using the removed database file
+    if bpo.db.engine:
+        bpo.db.engine.dispose()
+
     logging.info("Removing all BPO data")
     for path in paths:
         if not os.path.exists(path):
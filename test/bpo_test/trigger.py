@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 import bpo.config.const
+import bpo.helpers.worker
 import bpo_test
 import json
 import os
@@ -21,6 +22,9 @@ def api_request(path, headers={}, payload=None, files=None):
     if not ret.ok:
         bpo_test.stop_server_nok()
 
+    # Job callbacks return before their task is done
+    bpo.helpers.worker.wait()
+
 
 def push_hook_gitlab():
     token = bpo.config.const.test_tokens["push_hook_gitlab"]
@@ -0,0 +1,81 @@
+# Copyright 2022 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/db/__init__.py """
+import threading
+
+import bpo_test
+import bpo_test.trigger
+import bpo.db
+import bpo.repo
+import bpo.ui
+
+
+def test_set_package_status_multiple(monkeypatch):
+    # Fill the db with "hello-world", "hello-world-wrapper"
+    with bpo_test.BPOServer():
+        monkeypatch.setattr(bpo.repo, "build", bpo_test.stop_server)
+        bpo_test.trigger.job_callback_get_depends("master")
+
+    session = bpo.db.session()
+    packages = session.query(bpo.db.Package).order_by(bpo.db.Package.id).all()
+    assert len(packages) == 2
+    failed = bpo.db.PackageStatus.failed
+    building = bpo.db.PackageStatus.building
+    transitions = [(packages[0], failed, None),
+                   (packages[1], building, 1337)]
+
+    # Objects are updated, but nothing is written before the commit
+    bpo.db.set_package_status_multiple(session, transitions)
+    for package, _, _ in transitions:
+        bpo.ui.log_package(package, "test_multiple", session=session)
+    assert packages[0].status == failed
+    assert packages[1].status == building
+    assert packages[1].job_id == 1337
+    bpo_test.assert_package("hello-world", status="queued")
+
+    # Status changes and log rows get written in the same transaction
+    session.commit()
+    bpo_test.assert_package("hello-world", status="failed")
+    bpo_test.assert_package("hello-world-wrapper", status="building")
+    assert session.query(bpo.db.Log).filter_by(action="test_multiple")\
+        .count() == 2
+
+
+def test_db_writer_lock():
+    # Initialize the db
+    bpo_test.BPOServer()
+    session = bpo.db.session()
+
+    # Writing takes the lock until the commit
+    session.add(bpo.db.Log(action="test_first"))
+    session.flush()
+    assert bpo.db.writer_lock.locked()
+
+    # Reading does not wait for it
+    session_read = bpo.db.session()
+    assert session_read.query(bpo.db.Log).filter_by(action="test_first")\
+        .count() == 0
+
+    # Another thread waits with writing until the commit
+    written = []
+
+    def write():
+        session_thread = bpo.db.session()
+        session_thread.add(bpo.db.Log(action="test_second"))
+        session_thread.commit()
+        written.append(True)
+    thread = threading.Thread(target=write)
+    thread.start()
+    thread.join(0.5)
+    assert not written
+    session.commit()
+    thread.join()
+    assert written
+    assert not bpo.db.writer_lock.locked()
+
+    # Rollback releases the lock too
+    session.add(bpo.db.Log(action="test_third"))
+    session.flush()
+    assert bpo.db.writer_lock.locked()
+    session.rollback()
+    assert not bpo.db.writer_lock.locked()
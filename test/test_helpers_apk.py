@@ -2,9 +2,14 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 """ Testing bpo/helpers/apk.py """
 import collections
+import os
 import pytest
+import shutil
+import sys
 
-import bpo_test  # noqa
+import bpo_test
+import bpo.config.args
+import bpo.db
 import bpo.helpers.apk
 
 
@@ -41,3 +46,85 @@ def test_apk_get_metadata():
     expected["origin"] = "hello-world-wrapper"
 
     assert bpo.helpers.apk.get_metadata(apk) == expected
+
+
+def test_apk_get_pkginfo():
+    apk = bpo.config.const.top_dir + "/test/testdata/hello-world-1-r4.apk"
+    pkginfo = bpo.helpers.apk.get_pkginfo(apk)
+
+    assert pkginfo["pkgname"] == "hello-world"
+    assert pkginfo["pkgver"] == "1-r4"
+    assert pkginfo["commit"] == ""
+    assert pkginfo["provides"] == ["cmd:hello-world"]
+    assert pkginfo["depend"] == ["so:libc.musl-x86_64.so.1"]
+
+    with pytest.raises(RuntimeError) as e:
+        bpo.helpers.apk.parse_pkginfo([b"pkgver = 1-r0\n", b"pkgver = 2-r0\n"])
+    assert "found twice" in str(e.value)
+
+    # Other keys may be repeated, all values are kept
+    pkginfo = bpo.helpers.apk.parse_pkginfo([b"license = MIT\n",
+                                             b"license = GPL-2.0\n"])
+    assert pkginfo["license"] == ["MIT", "GPL-2.0"]
+
+
+def test_apk_get_metadata_cached(tmpdir, monkeypatch):
+    apk_orig = (bpo.config.const.top_dir +
+                "/test/testdata/hello-world-wrapper-subpkg-1-r2.apk")
+    apk = str(tmpdir) + "/hello-world-wrapper-subpkg-1-r2.apk"
+    shutil.copy(apk_orig, apk)
+    expected = bpo.helpers.apk.get_metadata(apk)
+
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo", "local"])
+    bpo.config.args.init()
+    bpo.db.init()
+    session = bpo.db.session()
+
+    # Cache miss: read the apk, without committing the caller's session
+    session.add(bpo.db.Log(action="test"))
+    assert bpo.helpers.apk.get_metadata(apk, True) == expected
+    session.rollback()
+    assert session.query(bpo.db.Log).count() == 0
+
+    # Cache hit: don't read the apk
+    monkeypatch.setattr(bpo.helpers.apk, "get_pkginfo_lines", None)
+    assert bpo.helpers.apk.get_metadata(apk, True) == expected
+
+    # Modified apk: read it again
+    monkeypatch.undo()
+    os.utime(apk, ns=(0, 0))
+    monkeypatch.setattr(bpo.helpers.apk, "get_metadata", bpo_test.true)
+    assert bpo.helpers.apk.get_metadata_cached(apk) is True
+
+    # Removed apk: remove from cache, only if it is in the given list
+    os.unlink(apk)
+    bpo.helpers.apk.prune_metadata_cache([str(tmpdir) + "/other.apk"])
+    assert session.query(bpo.db.ApkMetadata).count() == 1
+    bpo.helpers.apk.prune_metadata_cache([apk])
+    assert session.query(bpo.db.ApkMetadata).count() == 0
+
+
+def test_apk_get_metadata_multiple(tmpdir, monkeypatch):
+    testdata = bpo.config.const.top_dir + "/test/testdata/"
+    apks = []
+    for apk in ["hello-world-1-r4.apk", "hello-world-wrapper-1-r2.apk",
+                "hello-world-wrapper-subpkg-1-r2.apk"]:
+        shutil.copy(testdata + apk, str(tmpdir))
+        apks += [str(tmpdir) + "/" + apk]
+    expected = {apk: bpo.helpers.apk.get_metadata(apk) for apk in apks}
+
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo", "--jobs", "2", "local"])
+    bpo.config.args.init()
+    bpo.db.init()
+    session = bpo.db.session()
+
+    # Read in two processes, then get all from the cache
+    func = bpo.helpers.apk.get_metadata_multiple
+    assert func(apks[:1]) == {apks[0]: expected[apks[0]]}
+    with bpo.helpers.apk.get_process_pool() as pool:
+        assert func(apks, pool) == expected
+    assert session.query(bpo.db.ApkMetadata).count() == 3
+    monkeypatch.setattr(bpo.helpers.apk, "get_pkginfo_lines", None)
+    assert func(apks) == expected
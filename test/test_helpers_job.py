@@ -0,0 +1,37 @@
+# Copyright 2022 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/helpers/job.py """
+import bpo_test  # noqa
+import bpo.config.const
+import bpo.helpers.job
+import bpo.job_services.base
+
+
+def test_get_statuses_cache(monkeypatch):
+    status = bpo.job_services.base.JobStatus
+    requested = []
+
+    class JobService(bpo.job_services.base.JobService):
+        def get_status(self, job_id):
+            requested.append(job_id)
+            return status.running
+
+    monkeypatch.setattr(bpo.helpers.job, "jobservice", JobService())
+    bpo.helpers.job.invalidate_status()
+    func = bpo.helpers.job.get_statuses
+
+    # Only ask the job service for statuses that are not cached
+    assert func([1, 2]) == {1: status.running, 2: status.running}
+    assert func([2, 3]) == {2: status.running, 3: status.running}
+    assert sorted(requested) == [1, 2, 3]
+
+    # Ask again after invalidating one job
+    bpo.helpers.job.invalidate_status("2")
+    func([1, 2])
+    assert sorted(requested) == [1, 2, 2, 3]
+
+    # Ask again after the TTL
+    monkeypatch.setattr(bpo.config.const, "job_status_cache_ttl", 0)
+    func([1])
+    assert sorted(requested) == [1, 1, 2, 2, 3]
+    bpo.helpers.job.invalidate_status()
@@ -0,0 +1,163 @@
+# Copyright 2022 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/helpers/upload.py """
+import errno
+import hashlib
+import io
+import os
+import pytest
+import werkzeug.test
+
+import bpo_test
+import bpo.config.args
+import bpo.helpers.upload
+
+
+def get_environ(files):
+    """ :param files: list of (filename, content) tuples
+        :returns: WSGI environment of a request uploading the files """
+    data = {"file[]": [(io.BytesIO(content), filename)
+                       for filename, content in files]}
+    builder = werkzeug.test.EnvironBuilder(method="POST", data=data)
+    return builder.get_environ()
+
+
+def check_filename(filename):
+    if filename == "invalid.txt":
+        raise ValueError(f"Invalid filename: {filename}")
+
+
+def test_save_files(tmpdir):
+    path = str(tmpdir)
+    func = bpo.helpers.upload.save_files
+    content = b"hello world\n"
+    sha256 = hashlib.sha256(content).hexdigest()
+    sha512 = hashlib.sha512(content).hexdigest()
+
+    # Files without checksum files
+    environ = get_environ([("first.txt", content), ("second.txt", b"")])
+    assert func(environ, path, check_filename) == ["first.txt", "second.txt"]
+    with open(f"{path}/first.txt", "rb") as handle:
+        assert handle.read() == content
+    assert sorted(os.listdir(path)) == ["first.txt", "second.txt"]
+
+    # Files with valid checksum files
+    environ = get_environ([("first.txt.sha256", f"{sha256}  first.txt\n"
+                            .encode()),
+                           ("first.txt", content),
+                           ("first.txt.sha512", f"{sha512}  first.txt\n"
+                            .encode())])
+    func(environ, path, check_filename)
+    assert sorted(os.listdir(path)) == ["first.txt", "first.txt.sha256",
+                                        "first.txt.sha512", "second.txt"]
+
+    # Invalid checksum: nothing gets saved, no temp files are left
+    environ = get_environ([("third.txt", content),
+                           ("third.txt.sha256", b"1234  third.txt\n")])
+    with pytest.raises(ValueError) as e:
+        func(environ, path, check_filename)
+    assert str(e.value) == "Invalid sha256 checksum: third.txt"
+    assert "third.txt" not in os.listdir(path)
+    assert len(os.listdir(path)) == 4
+
+    # Invalid filename
+    environ = get_environ([("fourth.txt", content), ("invalid.txt", b"")])
+    with pytest.raises(ValueError) as e:
+        func(environ, path, check_filename)
+    assert str(e.value) == "Invalid filename: invalid.txt"
+    assert len(os.listdir(path)) == 4
+
+
+def test_save_staged_files(monkeypatch, tmpdir):
+    temp_path = str(tmpdir) + "/temp"
+    path = str(tmpdir) + "/target"
+    os.makedirs(path)
+    monkeypatch.setattr(bpo.config.args, "temp_path", temp_path, raising=False)
+    content = b"0123456789"
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    # Upload the file in chunks, in any order
+    func = bpo.helpers.upload.init_staged_file
+    assert func("1", "first.txt", len(content)) == []
+    bpo.helpers.upload.write_chunk("1", "first.txt", 8, io.BytesIO(b"89"), 2)
+    bpo.helpers.upload.write_chunk("1", "first.txt", 0, io.BytesIO(b"0123"),
+                                   4)
+
+    # Incomplete upload
+    with pytest.raises(ValueError) as e:
+        bpo.helpers.upload.save_staged_files("1", ["first.txt"], path,
+                                             check_filename)
+    assert str(e.value) == "Upload is incomplete: first.txt"
+
+    # Resume: chunks that were written already are kept
+    assert func("1", "first.txt", len(content)) == [[0, 4], [8, 2]]
+    bpo.helpers.upload.write_chunk("1", "first.txt", 4, io.BytesIO(b"4567"),
+                                   4)
+
+    # Chunk out of bounds
+    with pytest.raises(ValueError) as e:
+        bpo.helpers.upload.write_chunk("1", "first.txt", 8,
+                                       io.BytesIO(b"890"), 3)
+    assert str(e.value).startswith("Chunk is out of bounds")
+
+    # Checksum file
+    checksum = f"{sha256}  first.txt\n".encode()
+    func("1", "first.txt.sha256", len(checksum))
+    bpo.helpers.upload.write_chunk("1", "first.txt.sha256", 0,
+                                   io.BytesIO(checksum), len(checksum))
+
+    # Save the files, the staging dir gets removed
+    filenames = ["first.txt", "first.txt.sha256"]
+    assert bpo.helpers.upload.save_staged_files("1", filenames, path,
+                                                check_filename) == filenames
+    with open(f"{path}/first.txt", "rb") as handle:
+        assert handle.read() == content
+    assert not os.path.exists(f"{temp_path}/upload/1")
+
+    # temp_path on another file system: the file gets copied
+    def rename_exdev(src, dst):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    monkeypatch.setattr(os, "rename", rename_exdev)
+    func("2", "second.txt", len(content))
+    bpo.helpers.upload.write_chunk("2", "second.txt", 0, io.BytesIO(content),
+                                   len(content))
+    bpo.helpers.upload.save_staged_files("2", ["second.txt"], path,
+                                         check_filename)
+    with open(f"{path}/second.txt", "rb") as handle:
+        assert handle.read() == content
+    assert sorted(os.listdir(path)) == ["first.txt", "first.txt.sha256",
+                                        "second.txt"]
+
+    # Invalid job ID and filename
+    with pytest.raises(ValueError) as e:
+        func("../1", "first.txt", 1)
+    assert str(e.value) == "Invalid job ID: ../1"
+    with pytest.raises(ValueError) as e:
+        func("1", "../first.txt", 1)
+    assert str(e.value) == "Invalid filename: ../first.txt"
+
+
+def test_remove_temp_files(tmpdir):
+    path = str(tmpdir)
+    os.makedirs(f"{path}/sub")
+    for filename in ["sub/old.img.abc123.tmp", "sub/image.img"]:
+        with open(f"{path}/{filename}", "w"):
+            pass
+
+    # Leftover temp files get removed, running uploads are kept
+    upload = bpo.helpers.upload.HashingFile(f"{path}/sub/new.img")
+    bpo.helpers.upload.remove_temp_files(path)
+    assert sorted(os.listdir(f"{path}/sub")) == [
+        "image.img", os.path.basename(upload.path_temp)]
+    upload.commit()
+    assert sorted(os.listdir(f"{path}/sub")) == ["image.img", "new.img"]
+
+
+def test_hashing_file_error(monkeypatch, tmpdir):
+    # The temp file gets removed if it can't be prepared
+    path = str(tmpdir)
+    monkeypatch.setattr(os, "fchmod", bpo_test.raise_exception)
+    with pytest.raises(bpo.helpers.ThisExceptionIsExpectedAndCanBeIgnored):
+        bpo.helpers.upload.HashingFile(f"{path}/image.img")
+    assert os.listdir(path) == []
+    assert bpo.helpers.upload.temp_files == set()
@@ -0,0 +1,103 @@
+# Copyright 2022 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/helpers/worker.py """
+import bpo_test
+import bpo.db
+import bpo.helpers.worker
+
+
+def test_worker(monkeypatch):
+    # Initialize the db, start the WorkerThread
+    bpo_test.BPOServer()
+
+    results = []
+
+    def task(value):
+        results.append(value)
+    monkeypatch.setitem(bpo.helpers.worker.functions, "test_task", task)
+
+    # Tasks run in the order they were queued
+    bpo.helpers.worker.enqueue("test_task", value=1)
+    bpo.helpers.worker.enqueue("test_task", value=2)
+    bpo.helpers.worker.wait()
+    assert results == [1, 2]
+
+    # Task table is empty after running the tasks
+    session = bpo.db.session()
+    assert not bpo.helpers.worker.is_queued(session, "test_task")
+
+    # Queued task (without notifying the WorkerThread)
+    session.add(bpo.db.Task("test_task", {"value": 3}))
+    session.commit()
+    assert bpo.helpers.worker.is_queued(session, "test_task")
+
+    # unique=True: don't add the same task with the same arguments again
+    bpo.helpers.worker.stop()
+    monkeypatch.setattr(bpo.helpers.worker, "start", bpo_test.nop)
+    bpo.helpers.worker.enqueue("test_task", unique=True, value=3)
+    assert session.query(bpo.db.Task).count() == 1
+    bpo.helpers.worker.enqueue("test_task", unique=True, value=4)
+    assert session.query(bpo.db.Task).count() == 2
+
+
+def test_worker_block(monkeypatch):
+    # Initialize the db, start the WorkerThread
+    bpo_test.BPOServer()
+
+    results = []
+
+    def task(value, branch, arch=None, device=None):
+        results.append(value)
+    monkeypatch.setitem(bpo.helpers.worker.functions, "test_task", task)
+
+    # Blocked tasks are skipped, the others run
+    bpo.helpers.worker.block("master", "x86_64")
+    bpo.helpers.worker.enqueue("test_task", value=1, branch="master",
+                               arch="x86_64")
+    bpo.helpers.worker.enqueue("test_task", value=2, branch="master")
+    bpo.helpers.worker.enqueue("test_task", value=3, branch="master",
+                               arch="aarch64")
+    bpo.helpers.worker.wait()
+    assert results == [3]
+
+    # Unblocked tasks run in the order they were queued
+    bpo.helpers.worker.unblock("master", "x86_64")
+    bpo.helpers.worker.wait()
+    assert results == [3, 1, 2]
+
+    # Image tasks are blocked until the images are fixed too
+    bpo.helpers.worker.block_images()
+    bpo.helpers.worker.enqueue("test_task", value=4, branch="master",
+                               device="qemu-amd64")
+    bpo.helpers.worker.enqueue("test_task", value=5, branch="master")
+    bpo.helpers.worker.wait()
+    assert results == [3, 1, 2, 5]
+    bpo.helpers.worker.unblock_images()
+    bpo.helpers.worker.wait()
+    assert results == [3, 1, 2, 5, 4]
+    bpo.helpers.worker.stop()
+
+
+def test_worker_failure_handler(monkeypatch):
+    # Initialize the db, start the WorkerThread
+    bpo_test.BPOServer()
+
+    failed = []
+
+    def task(value):
+        raise RuntimeError("task failed")
+
+    def on_failure(value):
+        failed.append(value)
+
+    monkeypatch.setitem(bpo.helpers.worker.functions, "test_task", task)
+    monkeypatch.setitem(bpo.helpers.worker.failure_handlers, "test_task",
+                        on_failure)
+
+    # The failure handler gets the task's arguments, the task gets removed
+    bpo.helpers.worker.enqueue("test_task", value=1)
+    bpo.helpers.worker.wait()
+    assert failed == [1]
+    session = bpo.db.session()
+    assert not bpo.helpers.worker.is_queued(session, "test_task")
+    bpo.helpers.worker.stop()
@@ -4,6 +4,7 @@
 import os
 import pytest
 import sys
+import urllib3.util.retry
 
 import bpo_test  # noqa
 import bpo.config.const
@@ -46,3 +47,15 @@ def test_sourcehut_get_status(monkeypatch):
 
     # https://builds.sr.ht/~ollieparanoid/job/94499
     assert js.get_status(94499) == status.success
+
+
+def test_sourcehut_get_retry(monkeypatch):
+    retry = bpo.job_services.sourcehut.get_retry()
+    assert retry.total == bpo.config.const.sourcehut_retries
+
+    # urllib3 < 1.26 only knows method_whitelist
+    def retry_old(total, backoff_factor, status_forcelist, raise_on_status,
+                  method_whitelist):
+        return method_whitelist
+    monkeypatch.setattr(urllib3.util.retry, "Retry", retry_old)
+    assert bpo.job_services.sourcehut.get_retry() == ["GET"]
@@ -0,0 +1,43 @@
+# Copyright 2022 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/repo/scheduler.py """
+import bpo_test
+import bpo_test.trigger
+import bpo.db
+import bpo.repo
+import bpo.repo.scheduler
+
+
+def test_repo_scheduler(monkeypatch):
+    # Disable retry_count code path (tested separately)
+    monkeypatch.setattr(bpo.config.const, "retry_count_max", 0)
+
+    # Fill the db with "hello-world", "hello-world-wrapper"
+    with bpo_test.BPOServer():
+        monkeypatch.setattr(bpo.repo, "build", bpo_test.stop_server)
+        bpo_test.trigger.job_callback_get_depends("master")
+
+    session = bpo.db.session()
+    arch = "x86_64"
+    branch = "master"
+
+    # "hello-world-wrapper" depends on "hello-world"
+    depends = bpo.db.get_depends_ids(session, arch, branch)
+    hello = bpo.db.get_package(session, "hello-world", arch, branch)
+    wrapper = bpo.db.get_package(session, "hello-world-wrapper", arch, branch)
+    assert depends == {wrapper.id: [hello.id]}
+
+    # Only "hello-world" is ready, until it is marked as built
+    scheduler = bpo.repo.scheduler.Scheduler(session, arch, branch)
+    assert scheduler.next_package() == "hello-world"
+    assert scheduler.next_package() is None
+    scheduler.set_built("hello-world")
+    assert scheduler.next_package() == "hello-world-wrapper"
+    assert scheduler.next_package() is None
+
+    # Failed packages with retries left come before queued packages
+    monkeypatch.setattr(bpo.config.const, "retry_count_max", 1)
+    bpo.db.set_package_status(session, hello, bpo.db.PackageStatus.built)
+    bpo.db.set_package_status(session, wrapper, bpo.db.PackageStatus.failed)
+    scheduler = bpo.repo.scheduler.Scheduler(session, arch, branch)
+    assert scheduler.next_package() == "hello-world-wrapper"
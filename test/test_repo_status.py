@@ -204,3 +204,16 @@ def test_fix_db_vs_disk_missing_apks(monkeypatch):
     bpo.db.set_package_status(session, package, bpo.db.PackageStatus.built)
     func(arch, branch)
     bpo_test.assert_package("hello-world", status="queued")
+
+    # Built and published packages with missing apks, fixed in one pass: both
+    # get reset to queued, no matter which one comes first
+    published = bpo.db.PackageStatus.published
+    built = bpo.db.PackageStatus.built
+    for status_hw, status_wrapper in [(built, published), (published, built)]:
+        for pkgname, status in [("hello-world", status_hw),
+                                ("hello-world-wrapper", status_wrapper)]:
+            package = bpo.db.get_package(session, pkgname, arch, branch)
+            bpo.db.set_package_status(session, package, status)
+        func(arch, branch)
+        bpo_test.assert_package("hello-world", status="queued")
+        bpo_test.assert_package("hello-world-wrapper", status="queued")
@@ -0,0 +1,73 @@
+# Copyright 2022 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/repo/store.py """
+import bpo_test
+import bpo.config.args
+import bpo.repo.final
+import bpo.repo.store
+import bpo.repo.wip
+
+import os
+import shutil
+
+
+def test_repo_store(monkeypatch):
+    # Initialize bpo.config.args, remove repos and store
+    bpo_test.BPOServer()
+
+    apk = "hello-world-1-r4.apk"
+    apk_path = bpo.config.const.top_dir + "/test/testdata/" + apk
+    wip_master = bpo.repo.wip.get_path("x86_64", "master")
+    wip_stable = bpo.repo.wip.get_path("x86_64", "v22.06")
+    final_master = bpo.repo.final.get_path("x86_64", "master")
+    for path in [wip_master, wip_stable, final_master]:
+        os.makedirs(path)
+    shutil.copy(apk_path, wip_master)
+    shutil.copy(apk_path, wip_stable)
+    blob = bpo.repo.store.get_blob_path(bpo.repo.store.get_sha256(apk_path))
+
+    # Add new apk to the store
+    bpo.repo.store.add_repo(wip_master)
+    assert os.path.samefile(f"{wip_master}/{apk}", blob)
+
+    # Identical apk in another branch gets replaced with a link
+    bpo.repo.store.add_repo(wip_stable)
+    assert os.path.samefile(f"{wip_stable}/{apk}", blob)
+
+    # Publishing creates a link
+    bpo.repo.store.link(f"{wip_master}/{apk}", f"{final_master}/{apk}")
+    assert os.path.samefile(f"{final_master}/{apk}", blob)
+
+    # Blob stays in the store while it is linked from any repository
+    os.unlink(f"{wip_master}/{apk}")
+    os.unlink(f"{wip_stable}/{apk}")
+    bpo.repo.store.clean()
+    assert os.path.exists(blob)
+    os.unlink(f"{final_master}/{apk}")
+    bpo.repo.store.clean()
+    assert not os.path.exists(blob)
+
+    # Copying over a linked apk does not modify the file in the store
+    shutil.copy(apk_path, wip_master)
+    bpo.repo.store.link(f"{wip_master}/{apk}", f"{final_master}/{apk}")
+    other = "hello-world-1-r3.apk"
+    shutil.copy(bpo.config.const.top_dir + "/test/testdata/" + other,
+                f"{wip_stable}/{other}")
+    monkeypatch.setattr(bpo.repo.store, "add", lambda path: False)
+    bpo.repo.store.link(f"{wip_stable}/{other}", f"{final_master}/{apk}")
+    assert bpo.repo.store.get_sha256(blob) == \
+        bpo.repo.store.get_sha256(apk_path)
+    monkeypatch.undo()
+
+    # Store on another file system: apks get copied, without reading them
+    os.unlink(f"{wip_master}/{apk}")
+    os.unlink(f"{final_master}/{apk}")
+    bpo.repo.store.clean()
+    monkeypatch.setattr(bpo.repo.store, "is_usable", lambda path: False)
+    monkeypatch.setattr(bpo.repo.store, "get_sha256", bpo_test.raise_exception)
+    shutil.copy(apk_path, wip_master)
+    bpo.repo.store.add_repo(wip_master)
+    bpo.repo.store.link(f"{wip_master}/{apk}", f"{final_master}/{apk}")
+    assert not os.path.samefile(f"{wip_master}/{apk}",
+                                f"{final_master}/{apk}")
+    assert not os.path.exists(blob)
@@ -9,6 +9,7 @@ import bpo.repo.wip
 
 import shutil
 import os
+import tarfile
 
 
 def test_repo_wip_clean(monkeypatch):
@@ -42,8 +43,12 @@ def test_repo_wip_clean(monkeypatch):
     func(arch, branch)
     assert bpo.repo.get_apks(wip_path) == []
 
-    # Delete origin from db
+    # The metadata of the removed apk is not cached anymore
     session = bpo.db.session()
+    paths = [entry.path for entry in session.query(bpo.db.ApkMetadata)]
+    assert f"{wip_path}/{apk}" not in paths
+
+    # Delete origin from db
     origin_pkgname = "hello-world-wrapper"
     package = bpo.db.get_package(session, origin_pkgname, arch, branch)
     session.delete(package)
@@ -60,3 +65,37 @@ def test_repo_wip_clean(monkeypatch):
     shutil.copy(apk_path, wip_path)
     func(arch, branch)
     assert bpo.repo.get_apks(wip_path) == []
+
+
+def test_repo_wip_update_apkindex_incremental(monkeypatch):
+    arch = "x86_64"
+    branch = "master"
+    testdata = bpo.config.const.top_dir + "/test/testdata/"
+    wip_path = bpo.repo.wip.get_path(arch, branch)
+
+    # Initialize tools and keys
+    with bpo_test.BPOServer():
+        monkeypatch.setattr(bpo.repo, "build", bpo_test.stop_server)
+        bpo_test.trigger.job_callback_get_depends("master")
+
+    def get_indexed_pkgnames():
+        with tarfile.open(wip_path + "/APKINDEX.tar.gz", "r:gz") as tar:
+            with tar.extractfile("APKINDEX") as handle:
+                return sorted(line[2:] for line in handle.read().decode()
+                              .splitlines() if line.startswith("P:"))
+
+    # First index, without previous APKINDEX.tar.gz
+    os.makedirs(wip_path)
+    shutil.copy(testdata + "hello-world-1-r4.apk", wip_path)
+    bpo.repo.wip.update_apkindex(arch, branch)
+    assert get_indexed_pkgnames() == ["hello-world"]
+
+    # Second index, entry of hello-world gets taken from the previous index
+    shutil.copy(testdata + "hello-world-wrapper-1-r2.apk", wip_path)
+    bpo.repo.wip.update_apkindex(arch, branch)
+    assert get_indexed_pkgnames() == ["hello-world", "hello-world-wrapper"]
+
+    # Removed apks are removed from the index
+    os.unlink(wip_path + "/hello-world-1-r4.apk")
+    bpo.repo.wip.update_apkindex(arch, branch)
+    assert get_indexed_pkgnames() == ["hello-world-wrapper"]
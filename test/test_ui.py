@@ -70,3 +70,30 @@ def test_update_badge(monkeypatch):
     branches["v20.05"]["ignore_errors"] = True
     badge = func(session, func_pkgs(session), func_imgs(session))
     assert badge == "up-to-date"
+
+
+def test_update_later(monkeypatch):
+    # Don't let the UIUpdateThread update the UI during the test
+    monkeypatch.setattr(bpo.config.const, "ui_update_interval", 3600)
+
+    global update_count
+    update_count = 0
+
+    def update(session):
+        global update_count
+        update_count += 1
+    monkeypatch.setattr(bpo.ui, "update", update)
+    monkeypatch.setattr(bpo.db, "session", bpo_test.nop)
+
+    # Multiple changes result in one update
+    bpo.ui.update_later()
+    bpo.ui.update_later()
+    bpo.ui.update_later()
+    bpo.ui.update_flush()
+    assert update_count == 1
+
+    # Nothing changed: no update
+    bpo.ui.update_flush()
+    assert update_count == 1
+
+    bpo.ui.update_thread_stop()
@@ -1,12 +1,15 @@
 # Copyright 2022 Oliver Smith
 # SPDX-License-Identifier: AGPL-3.0-or-later
 """ Testing bpo/api/public/update_job_status.py """
+import json
 import requests
 
 import bpo_test
 import bpo_test.trigger
 import bpo.db
+import bpo.helpers.worker
 import bpo.jobs.build_package
+import bpo.repo
 
 
 def test_public_update_job_status(monkeypatch):
@@ -51,3 +54,63 @@ def test_public_update_job_status(monkeypatch):
 
     # Verify package status
     bpo_test.assert_package(pkgname, status="failed")
+
+
+def test_public_update_job_status_event(monkeypatch):
+    """ Only update the package of the job, that the event is about. """
+    arch = "x86_64"
+    branch = "master"
+    version = "1-r4"
+
+    monkeypatch.setattr(bpo.config.const, "retry_count_max", 0)
+
+    with bpo_test.BPOServer():
+        monkeypatch.setattr(bpo.repo, "build", bpo_test.stop_server)
+
+        # Add two packages with status building and different job IDs
+        session = bpo.db.session()
+        for pkgname, job_id in [("hello-world", 1111),
+                                ("second-package", 2222)]:
+            package = bpo.db.Package(arch, branch, pkgname, version)
+            package.status = bpo.db.PackageStatus.building
+            package.job_id = job_id
+            session.merge(package)
+        session.commit()
+
+        requests.post("http://127.0.0.1:5000/api/public/update-job-status",
+                      json={"id": 1111, "status": "failed"})
+
+    # The local job service reports both jobs as failed (from previous bpo
+    # instance), but only the job from the event was checked
+    bpo_test.assert_package("hello-world", status="failed")
+    bpo_test.assert_package("second-package", status="building")
+
+
+def test_public_update_job_status_unknown_id(monkeypatch):
+    """ Events with IDs of jobs that are not building don't add tasks. """
+    server = bpo_test.BPOServer()
+    client = server.thread.srv.app.test_client()
+
+    # Add "hello-world" package to DB, status: building
+    session = bpo.db.session()
+    package = bpo.db.Package("x86_64", "master", "hello-world", "1-r4")
+    package.status = bpo.db.PackageStatus.building
+    package.job_id = 1111
+    session.merge(package)
+    session.commit()
+
+    # Keep the tasks in the queue
+    bpo.helpers.worker.stop()
+    monkeypatch.setattr(bpo.helpers.worker, "start", bpo_test.nop)
+
+    url = "/api/public/update-job-status"
+    for job_id in [1, 2, 3]:
+        client.post(url, json={"id": job_id, "status": "failed"})
+    client.post(url)
+    assert session.query(bpo.db.Task).count() == 1
+
+    client.post(url, json={"id": 1111, "status": "failed"})
+    client.post(url, json={"id": 1111, "status": "failed"})
+    tasks = session.query(bpo.db.Task).all()
+    assert [json.loads(task.payload) for task in tasks] == [{},
+                                                            {"job_id": 1111}]